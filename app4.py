@@ -1,41 +1,213 @@
 import io
 import json
+import sqlite3
+from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog
+import numpy as np
 import torch
+from torchvision import transforms as T
 from transformers import CLIPProcessor, CLIPModel
 
+# Opcjonalny dekoder libjpeg-turbo (kilkukrotnie szybszy niż zwykły PIL);
+# bez niego dekodujemy przez PIL, nadal w wątku pobierającym.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+
+# Opcjonalne strumieniowe parsowanie JSON - dla wielotysięcznych manifestów
+# nie budujemy pełnego drzewa dokumentu tylko po to, żeby odczytać canvasy.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Opcjonalny klient httpx z HTTP/2 - multipleksowane strumienie do jednego
+# serwera IIIF i jednorazowy handshake TLS; bez niego zostaje requests.Session.
+try:
+    import httpx
+    HTTP_STATUS_ERRORS = (requests.exceptions.HTTPError, httpx.HTTPStatusError)
+except ImportError:
+    httpx = None
+    HTTP_STATUS_ERRORS = (requests.exceptions.HTTPError,)
+
+# Opcjonalny orjson - natywna serializacja JSON; stdlib-owy pretty-printer
+# jest czysto pythonowy i buduje cały wynikowy string w pamięci.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Opcjonalny ONNX Runtime - fuzja kerneli enkodera obrazu bez narzutu eager PyTorch
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+ONNX_PATH = Path.home() / ".cover_finder_vit-h.onnx"
+
 MODEL_ID = "laion/CLIP-ViT-H-14-laion2B-s32B-b79K"
 clip_model = None
 clip_processor = None
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-def classify(image_bytes: bytes) -> dict:
-    """Klasyfikuje obraz na podstawie podanych opisów tekstowych."""
+# Rozmiar wsadu dla klasyfikacji (ile obrazów naraz trafia do modelu)
+BATCH_SIZE = 16
+
+# Ile stron przed konsumentem może czekać w locie (pobranych i zdekodowanych).
+# Ogranicza pamięć przy dużych manifestach - bez limitu cały zakres stron
+# siedziałby zdekodowany w RAM
+PREFETCH_PAGES = 32
+
+# CLIP i tak zmniejsza obraz do 224x224 - nie ma sensu pobierać 1200 px.
+# 336 px daje zapas na center-crop, a pobieramy ~10x mniej bajtów.
+IIIF_IMAGE_WIDTH = 336
+
+# Opisy tekstowe klas - stałe dla całej analizy, kodowane tylko raz
+OPISY = (
+    "a photo of a newspaper cover with a title and masthead",
+    "a photo of an internal page with articles and blocks of body text (not title and masthead)",
+    "a photo of an internal page full of advertisements or announcements (not title and masthead)",
+    "a photo of an internal page with a large illustration or photograph (not title and masthead)",
+    "a photo of a table of contents or an editorial page (not title and masthead)"
+)
+
+# Zakodowane raz cechy tekstowe opisów - wypełniane przez encode_texts_once()
+text_features = None
+logit_scale = None
+
+# Preprocessing obrazu zbudowany raz (kanoniczne statystyki CLIP) -
+# omija wolną, interpretowaną ścieżkę CLIPProcessor dla każdego obrazu.
+resize_crop = T.Compose([T.Resize(224, antialias=True), T.CenterCrop(224)])
+normalize = T.Normalize(mean=[0.48145466, 0.4578275, 0.40821073],
+                        std=[0.26862954, 0.26130258, 0.27577711])
+
+def preprocess_image(image) -> torch.Tensor:
+    """Zamienia obraz PIL lub ndarray HWC na znormalizowany tensor 3x224x224."""
+    if isinstance(image, Image.Image):
+        tensor = T.functional.pil_to_tensor(image)
+    else:
+        tensor = torch.from_numpy(image).permute(2, 0, 1)
+    tensor = resize_crop(tensor)
+    return normalize(tensor.float().div_(255.0))
+
+def encode_texts_once():
+    """Koduje 5 opisów tekstowych jednorazowo po załadowaniu modelu.
+
+    Dzięki temu gorąca pętla analizy uruchamia tylko enkoder obrazu,
+    zamiast tokenizować i przepuszczać te same opisy przez model dla każdej strony.
+    """
+    global text_features, logit_scale
+    inputs = clip_processor(text=list(OPISY), return_tensors="pt", padding=True).to(device)
+    with torch.inference_mode():
+        tf = clip_model.get_text_features(**inputs)
+        text_features = tf / tf.norm(dim=-1, keepdim=True)
+        logit_scale = clip_model.logit_scale.exp()
+
+# Sesja onnxruntime dla enkodera obrazu - wypełniana przez build_onnx_session()
+onnx_session = None
+onnx_input_dtype = np.float32
+
+class VisionEncoder(torch.nn.Module):
+    """Enkoder obrazu CLIP jako samodzielny moduł do eksportu ONNX.
+
+    Łączy vision_model z projekcją, więc wyjście to gotowe cechy obrazu.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        return self.visual_projection(self.vision_model(pixel_values)[1])
+
+def build_onnx_session():
+    """Eksportuje enkoder obrazu do ONNX (raz, z cache na dysku) i otwiera sesję.
+
+    Przy braku onnxruntime lub nieudanym eksporcie zostaje ścieżka PyTorch.
+    """
+    global onnx_session, onnx_input_dtype
+    if onnxruntime is None:
+        return
+    try:
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        if not ONNX_PATH.exists():
+            dummy = torch.zeros((1, 3, 224, 224), dtype=dtype, device=device)
+            torch.onnx.export(
+                VisionEncoder(clip_model), dummy, str(ONNX_PATH),
+                opset_version=17,
+                input_names=['pixel_values'], output_names=['image_features'],
+                dynamic_axes={'pixel_values': {0: 'N'}, 'image_features': {0: 'N'}},
+            )
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == "cuda" else ['CPUExecutionProvider']
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        onnx_session = onnxruntime.InferenceSession(str(ONNX_PATH), sess_options=options, providers=providers)
+        onnx_input_dtype = np.float16 if dtype == torch.float16 else np.float32
+        print("Enkoder obrazu działa przez ONNX Runtime.")
+    except Exception as e:
+        onnx_session = None
+        print(f"Info: eksport do ONNX nie powiódł się, używam ścieżki PyTorch. ({e})")
+
+# Przypięty (pinned) bufor hosta - pozwala na asynchroniczne kopie CPU->GPU
+pinned_buffer = None
+
+def _to_device(cpu_batch: torch.Tensor) -> torch.Tensor:
+    """Przenosi wsad na GPU przez przypięty bufor hosta (kopiowanie asynchroniczne)."""
+    global pinned_buffer
+    if device != "cuda":
+        return cpu_batch
+    if pinned_buffer is None or pinned_buffer.shape[0] < cpu_batch.shape[0]:
+        pinned_buffer = torch.empty(cpu_batch.shape, pin_memory=True)
+    pinned = pinned_buffer[:cpu_batch.shape[0]]
+    pinned.copy_(cpu_batch)
+    return pinned.to(device, non_blocking=True)
+
+def classify_batch(images: list) -> list:
+    """Klasyfikuje całą paczkę obrazów jednym przebiegiem enkodera obrazu.
+
+    Zwraca listę słowników (po jednym na obraz) w tej samej kolejności.
+    """
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
-            "a photo of a newspaper cover with a title and masthead",
-            "a photo of an internal page with articles and blocks of body text (not title and masthead)",
-            "a photo of an internal page full of advertisements or announcements (not title and masthead)",
-            "a photo of an internal page with a large illustration or photograph (not title and masthead)",
-            "a photo of a table of contents or an editorial page (not title and masthead)"
-        ]
-        inputs = clip_processor(text=opisy, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
-        prob = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        best = prob.argmax()
-        return {
-            "prawdopodobienstwo": float(prob[best]),
-            "jest_okladka": bool(best == 0)
-        }
+        cpu_batch = torch.stack([preprocess_image(img) for img in images])
+        if onnx_session is not None:
+            surowe = onnx_session.run(None, {"pixel_values": cpu_batch.numpy().astype(onnx_input_dtype)})[0]
+            image_features = torch.from_numpy(surowe).to(device)
+            with torch.inference_mode():
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                logits = logit_scale * image_features @ text_features.T
+        else:
+            pixel_values = _to_device(cpu_batch)
+            # Układ NHWC pasuje do kerneli cuDNN bez wewnętrznych permutacji
+            pixel_values = pixel_values.to(memory_format=torch.channels_last)
+            with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+                image_features = clip_model.get_image_features(pixel_values=pixel_values)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                logits = logit_scale * image_features @ text_features.T
+        # Softmax liczymy w pełnej precyzji, żeby uniknąć utraty dokładności w fp16
+        prob = logits.float().softmax(dim=1).cpu().numpy()
+        wyniki = []
+        for wiersz in prob:
+            best = wiersz.argmax()
+            wyniki.append({
+                "prawdopodobienstwo": float(wiersz[best]),
+                "jest_okladka": bool(best == 0),
+                # Pełny wektor prawdopodobieństw - trafia do cache wyników na dysku
+                "probs": wiersz.astype(np.float16)
+            })
+        return wyniki
     except Exception as e:
-        return {f"Błąd przetwarzania obrazu: {e}"}
+        # Zawsze słownik (wcześniej literał zbioru!), żeby wywołujący mógł
+        # bezpiecznie sprawdzić klucz "error" i pominąć tylko ten wsad.
+        return [{"error": str(e), "prawdopodobienstwo": 0.0, "jest_okladka": False}] * len(images)
 
 class CoverFinderApp:
     def __init__(self, root):
@@ -86,15 +258,116 @@ class CoverFinderApp:
 
         self.frame.columnconfigure(1, weight=1)
         
+        # --- Pula wątków i współdzielony klient HTTP ---
+        self.download_pool = ThreadPoolExecutor(max_workers=16)
+        if httpx is not None:
+            self.http = httpx.Client(http2=True, timeout=30,
+                                     limits=httpx.Limits(max_connections=32, max_keepalive_connections=16))
+        else:
+            self.http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+            self.http.mount("http://", adapter)
+            self.http.mount("https://", adapter)
+
+        # --- Cache wyników klasyfikacji na dysku (klucz: canvas_id) ---
+        # Ponowna analiza tego samego manifestu nie pobiera ani nie klasyfikuje
+        # stron, które już kiedyś przeszły przez model.
+        self.cache = sqlite3.connect(Path.home() / ".cover_finder_cache.sqlite", check_same_thread=False)
+        self.cache.execute("CREATE TABLE IF NOT EXISTS wyniki (canvas_id TEXT PRIMARY KEY, probs BLOB)")
+        self.cache.commit()
+
         # --- Zmienne stanu aplikacji ---
         self.canvases = []
+        self.image_service_urls = []
         self.liczba_wszystkich_stron = 0
         self.manifest_data = None
-        self.analysed_pages = []
+        self.manifest_bytes = None
+        # Wyniki analizy w układzie kolumnowym (SoA) zamiast listy słowników:
+        # tablice indeksowane pozycją strony w analizowanym zakresie.
+        self.page_prob = None
+        self.page_is_cover = None
+        self.page_canvas_id = []
+        self.analysed_start_page = 0
 
         self.log("Wklej link do manifestu i kliknij 'Pobierz informacje'.")
         self.log("Uwaga: pierwsze uruchomienie może potrwać długo (pobieranie modelu ok. 3.5 GB).")
 
+        # --- Ładowanie modelu w tle - okno jest od razu responsywne, a użytkownik
+        # może w międzyczasie wkleić link i pobrać manifest.
+        self.model_ready = False
+        self.log(f"Ładowanie modelu w tle: {MODEL_ID}...")
+        self.progressbar.config(mode='indeterminate')
+        self.show_progress_bar(True)
+        self.progressbar.start(10)
+        threading.Thread(target=self._load_model, daemon=True).start()
+
+    def _load_model(self):
+        global clip_model, clip_processor
+        try:
+            # Wagi strumieniowane z safetensors prosto na urządzenie docelowe w fp16 -
+            # bez materializowania pełnego checkpointu fp32 (~14 GB) w RAM-ie hosta.
+            load_kwargs = dict(
+                torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                device_map=device,
+            )
+            try:
+                # Fuzja QK^T + softmax + AV w jeden kernel (FlashAttention/SDPA)
+                clip_model = CLIPModel.from_pretrained(MODEL_ID, attn_implementation="sdpa", **load_kwargs)
+            except TypeError:
+                # Starsze wersje transformers nie znają attn_implementation
+                clip_model = CLIPModel.from_pretrained(MODEL_ID, **load_kwargs)
+            clip_model = clip_model.to(memory_format=torch.channels_last)
+            clip_model.eval()
+            clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+            encode_texts_once()
+            # Najpierw próbujemy ONNX Runtime; kompilacja PyTorch tylko jako plan B
+            build_onnx_session()
+            if onnx_session is None:
+                try:
+                    # Kompilacja enkodera obrazu usuwa narzut dyspatchu Pythona przy każdym przebiegu
+                    clip_model.vision_model = torch.compile(clip_model.vision_model, mode="reduce-overhead", fullgraph=False)
+                except Exception as e:
+                    print(f"Info: torch.compile niedostępny, używam modelu bez kompilacji. ({e})")
+            # Cechy tekstowe są już zakodowane - wieża tekstowa tylko zajmuje VRAM.
+            # classify_batch używa wyłącznie get_image_features, które jej nie dotyka.
+            del clip_model.text_model
+            del clip_model.text_projection
+            if device == "cuda":
+                torch.cuda.empty_cache()
+            self.root.after(0, self._on_model_ready)
+        except Exception as e:
+            self.root.after(0, self._on_model_failed, e)
+
+    def _on_model_failed(self, blad):
+        # Zatrzymujemy animację i przywracamy spójny stan okna - bez tego pasek
+        # nieokreślony kręciłby się w nieskończoność, a przycisk analizy zostałby
+        # zablokowany na zawsze bez żadnej drogi wyjścia
+        self.progressbar.stop()
+        self.progressbar.config(mode='determinate')
+        self.show_progress_bar(False)
+        self.log(f"BŁĄD KRYTYCZNY: Nie udało się załadować lub pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {blad}")
+        self.set_ui_state(tk.NORMAL)
+        # Przycisk analizy zamienia się w przycisk ponownej próby załadowania
+        self.analyze_button.config(text="Ponów ładowanie modelu", command=self._retry_model_load, state=tk.NORMAL)
+
+    def _retry_model_load(self):
+        self.analyze_button.config(text="Rozpocznij Analizę", command=self.start_analysis_thread, state=tk.DISABLED)
+        self.log(f"Ponawiam ładowanie modelu: {MODEL_ID}...")
+        self.progressbar.config(mode='indeterminate')
+        self.show_progress_bar(True)
+        self.progressbar.start(10)
+        threading.Thread(target=self._load_model, daemon=True).start()
+
+    def _on_model_ready(self):
+        self.model_ready = True
+        self.progressbar.stop()
+        self.progressbar.config(mode='determinate')
+        self.show_progress_bar(False)
+        self.log(f"Model CLIP załadowany i działa na: {device.upper()}")
+        self.set_ui_state(tk.NORMAL)
+
     def log(self, message):
         self.log_area.insert(tk.END, message + "\n")
         self.log_area.see(tk.END)
@@ -104,7 +377,7 @@ class CoverFinderApp:
             widget.config(state=state)
         
         self.edit_button.config(state=tk.DISABLED)
-        if state == tk.NORMAL and self.analysed_pages:
+        if state == tk.NORMAL and self.page_prob is not None:
             self.edit_button.config(state=tk.NORMAL)
 
         if state == tk.NORMAL and self.liczba_wszystkich_stron == 0:
@@ -112,6 +385,10 @@ class CoverFinderApp:
             self.start_page_entry.config(state=tk.DISABLED)
             self.end_page_entry.config(state=tk.DISABLED)
 
+        # Analiza czeka, aż model załaduje się w tle
+        if state == tk.NORMAL and not self.model_ready:
+            self.analyze_button.config(state=tk.DISABLED)
+
     def show_progress_bar(self, show=True):
         if show:
             self.progress_label.grid(row=0, column=0, padx=(0, 5))
@@ -124,7 +401,9 @@ class CoverFinderApp:
 
     def start_fetch_thread(self):
         self.set_ui_state(tk.DISABLED)
-        self.analysed_pages = []
+        self.page_prob = None
+        self.page_is_cover = None
+        self.page_canvas_id = []
         threading.Thread(target=self.fetch_manifest_data, daemon=True).start()
 
     def fetch_manifest_data(self):
@@ -136,12 +415,30 @@ class CoverFinderApp:
 
         try:
             self.log(f"\nPobieranie informacji z manifestu: {manifest_url}...")
-            response = requests.get(manifest_url, timeout=20)
+            response = self.http.get(manifest_url, timeout=20)
             response.raise_for_status()
-            self.manifest_data = response.json()
-            self.canvases = self.manifest_data.get('sequences', [{}])[0].get('canvases', [])
+            self.manifest_bytes = response.content
+            if ijson is not None:
+                # Strumieniowo wyciągamy z canvasów tylko pola faktycznie używane;
+                # pełny dokument parsujemy dopiero przy zapisie manifestu.
+                self.manifest_data = None
+                self.canvases = []
+                for canvas in ijson.items(io.BytesIO(self.manifest_bytes), 'sequences.item.canvases.item'):
+                    self.canvases.append({k: canvas[k] for k in ('@id', 'label', 'images') if k in canvas})
+            else:
+                self.manifest_data = json.loads(self.manifest_bytes)
+                self.canvases = self.manifest_data.get('sequences', [{}])[0].get('canvases', [])
             self.liczba_wszystkich_stron = len(self.canvases)
 
+            # Jednorazowa ekstrakcja adresów serwisów obrazów - zamiast łańcucha
+            # czterech .get() z tymczasowymi słownikami dla każdej strony w analizie
+            self.image_service_urls = []
+            for c in self.canvases:
+                try:
+                    self.image_service_urls.append(c['images'][0]['resource']['service']['@id'])
+                except (KeyError, IndexError, TypeError):
+                    self.image_service_urls.append(None)
+
             if self.liczba_wszystkich_stron == 0:
                 self.log("BŁĄD: W podanym manifeście nie znaleziono żadnych stron (canvases).")
             else:
@@ -153,6 +450,7 @@ class CoverFinderApp:
         except Exception as e:
             self.log(f"Błąd pobierania manifestu: {e}")
             self.manifest_data = None
+            self.manifest_bytes = None
         finally:
             self.set_ui_state(tk.NORMAL)
 
@@ -189,43 +487,119 @@ class CoverFinderApp:
         
         canvases_to_analyze = self.canvases[start_index:end_index]
         total_to_process = len(canvases_to_analyze)
-        
-        self.analysed_pages = []
-        for i, canvas in enumerate(canvases_to_analyze):
-            current_page_number = start_page + i
-            
-            page_info = {
-                "identyfikator": f"Strona {current_page_number} (Etykieta: '{canvas.get('label', '[Brak]')}')",
-                "numer_strony": current_page_number,
-                "canvas_id": canvas.get('@id'),
-                "jest_okladka": False,
-                "prawdopodobienstwo": 0.0
-            }
-            
-            image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-            if not image_service_url:
-                self.analysed_pages.append(page_info)
-                continue
 
-            try:
-                image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-                response = requests.get(image_url, timeout=30)
-                response.raise_for_status()
-                wynik_analizy = classify(response.content)
-
-                if 'błąd' not in wynik_analizy:
-                    page_info.update(wynik_analizy)
+        # --- Wyniki w układzie kolumnowym: jedna tablica na kolumnę ---
+        self.analysed_start_page = start_page
+        self.page_prob = np.zeros(total_to_process, dtype=np.float32)
+        self.page_is_cover = np.zeros(total_to_process, dtype=bool)
+        self.page_canvas_id = [c.get('@id') for c in canvases_to_analyze]
+
+        # --- Przygotowanie adresów obrazów (adresy serwisów wyciągnięte przy pobraniu manifestu) ---
+        adresy = []
+        for image_service_url in self.image_service_urls[start_index:end_index]:
+            if image_service_url:
+                adresy.append(f"{image_service_url.rstrip('/')}/full/{IIIF_IMAGE_WIDTH},/0/default.jpg")
+            else:
+                adresy.append(None)
 
-            except Exception as e:
-                self.log(f"Info: Pomijam stronę {current_page_number} z powodu błędu pobierania/analizy: {e}")
-            
-            self.analysed_pages.append(page_info)
-            
-            progress_value = (i + 1) / total_to_process * 100
-            self.root.after(0, self.update_progress, progress_value)
+        # --- Trafienia z cache: wynik bez pobierania i bez klasyfikacji ---
+        cache_hit = np.zeros(total_to_process, dtype=bool)
+        for k, canvas_id in enumerate(self.page_canvas_id):
+            if not canvas_id:
+                continue
+            row = self.cache.execute("SELECT probs FROM wyniki WHERE canvas_id = ?", (canvas_id,)).fetchone()
+            if row:
+                probs = np.frombuffer(row[0], dtype=np.float16)
+                best = int(probs.argmax())
+                self.page_prob[k] = float(probs[best])
+                self.page_is_cover[k] = (best == 0)
+                cache_hit[k] = True
+        if cache_hit.any():
+            self.log(f"Info: {int(cache_hit.sum())} stron wzięto z cache wyników.")
+
+        # --- Pobieranie równolegle, ale tylko okno stron przed konsumentem ---
+        # Dzięki temu pobieranie kolejnych stron nakłada się z klasyfikacją na
+        # GPU, a w locie (pobrane i zdekodowane, ~0.5 MB każda) czeka najwyżej
+        # PREFETCH_PAGES stron - zgłoszenie wszystkich naraz buforowałoby
+        # w RAM cały zakres, setki MB przy tysiącstronicowym manifeście.
+        futures = {}
+        nastepna_do_zgloszenia = 0
+
+        def zglos_pobrania_do(granica):
+            nonlocal nastepna_do_zgloszenia
+            while nastepna_do_zgloszenia < min(granica, total_to_process):
+                k = nastepna_do_zgloszenia
+                if adresy[k] and not cache_hit[k]:
+                    futures[k] = self.download_pool.submit(self._download, adresy[k])
+                nastepna_do_zgloszenia += 1
+
+        # --- Klasyfikacja wsadami w kolejności stron ---
+        # Postęp i logi zgłaszamy raz na wsad, a nie raz na stronę - każde
+        # root.after() to osobne przejście przez pętlę zdarzeń Tk.
+        self._last_pct = -1
+        for batch_start in range(0, total_to_process, BATCH_SIZE):
+            zglos_pobrania_do(batch_start + BATCH_SIZE + PREFETCH_PAGES)
+            batch_indices = []
+            batch_images = []
+            komunikaty = []
+            for k in range(batch_start, min(batch_start + BATCH_SIZE, total_to_process)):
+                future = futures.pop(k, None)
+                if future is None:
+                    continue
+                try:
+                    batch_images.append(future.result())
+                    batch_indices.append(k)
+                except Exception as e:
+                    komunikaty.append(f"Info: Pomijam stronę {start_page + k} z powodu błędu pobierania: {e}")
+
+            if batch_images:
+                wyniki_wsadu = classify_batch(batch_images)
+                nowe_wpisy = []
+                for k, wynik_analizy in zip(batch_indices, wyniki_wsadu):
+                    if "error" in wynik_analizy:
+                        komunikaty.append(f"Info: Pomijam stronę {start_page + k} z powodu błędu analizy: {wynik_analizy['error']}")
+                        continue
+                    self.page_prob[k] = wynik_analizy["prawdopodobienstwo"]
+                    self.page_is_cover[k] = wynik_analizy["jest_okladka"]
+                    if self.page_canvas_id[k]:
+                        nowe_wpisy.append((self.page_canvas_id[k], wynik_analizy["probs"].tobytes()))
+                if nowe_wpisy:
+                    self.cache.executemany("INSERT OR REPLACE INTO wyniki VALUES (?, ?)", nowe_wpisy)
+                    self.cache.commit()
+
+            if komunikaty:
+                self.log("\n".join(komunikaty))
+
+            pct = int(min(batch_start + BATCH_SIZE, total_to_process) / total_to_process * 100)
+            if pct != self._last_pct:
+                self._last_pct = pct
+                self.root.after_idle(self.update_progress, pct)
 
         self.root.after(0, self.finalize_analysis)
 
+    def _download(self, image_url):
+        """Pobiera i od razu dekoduje obraz w wątku puli.
+
+        Dekodowanie JPEG schodzi z wątku inferencji, więc nakłada się
+        z kolejnymi pobraniami i z przebiegiem modelu.
+        """
+        try:
+            response = self.http.get(image_url, timeout=30)
+            response.raise_for_status()
+        except HTTP_STATUS_ERRORS:
+            # Niektóre serwery IIIF odrzucają niestandardowe rozmiary - spróbuj zapisu '!400,400'
+            fallback_url = image_url.replace(f"/full/{IIIF_IMAGE_WIDTH},/", "/full/!400,400/")
+            if fallback_url == image_url:
+                raise
+            response = self.http.get(fallback_url, timeout=30)
+            response.raise_for_status()
+        if turbo_jpeg is not None:
+            # Zwraca ndarray HWC RGB, który clip_processor przyjmuje bezpośrednio
+            return turbo_jpeg.decode(response.content, pixel_format=TJPF_RGB)
+        image = Image.open(io.BytesIO(response.content)).convert('RGB')
+        image.load()
+        return image
+
     def update_progress(self, value):
         self.progressbar['value'] = value
         self.progress_percent_label.config(text=f"{int(value)}%")
@@ -234,23 +608,26 @@ class CoverFinderApp:
         self.show_progress_bar(False)
         self.log("\n### PODSUMOWANIE ANALIZY ###")
 
-        okladki = [p for p in self.analysed_pages if p.get("jest_okladka")]
+        # Indeksy okładek wprost z tablicy; np.where zwraca je już w kolejności stron
+        indeksy_okladek = np.where(self.page_is_cover)[0] if self.page_is_cover is not None else np.array([], dtype=int)
 
-        if not okladki:
+        if indeksy_okladek.size == 0:
             self.log("\nNie zidentyfikowano żadnej strony jako okładki w podanym zakresie.")
         else:
-            self.log(f"\nZnaleziono {len(okladki)} potencjalnych okładek (posortowane wg nr strony):")
-            okladki.sort(key=lambda x: x['numer_strony'])
-            for okladka in okladki:
-                prawdopodobienstwo_str = f"{okladka.get('prawdopodobienstwo', 0):.2%}"
-                self.log(f"- {okladka['identyfikator']:<50} | Prawdopodobieństwo: {prawdopodobienstwo_str}")
+            self.log(f"\nZnaleziono {indeksy_okladek.size} potencjalnych okładek (posortowane wg nr strony):")
+            for k in indeksy_okladek:
+                numer_strony = self.analysed_start_page + int(k)
+                label = self.canvases[numer_strony - 1].get('label', '[Brak]')
+                identyfikator = f"Strona {numer_strony} (Etykieta: '{label}')"
+                prawdopodobienstwo_str = f"{self.page_prob[k]:.2%}"
+                self.log(f"- {identyfikator:<50} | Prawdopodobieństwo: {prawdopodobienstwo_str}")
 
         self.log("\n" + "#"*80)
         self.log("Analiza zakończona. Możesz teraz edytować wyniki i zapisać manifest.")
         self.set_ui_state(tk.NORMAL)
 
     def open_edit_window(self):
-        if not self.analysed_pages:
+        if self.page_prob is None:
             self.log("BŁĄD: Najpierw przeprowadź analizę.")
             return
 
@@ -258,77 +635,75 @@ class CoverFinderApp:
         edit_win.title("Edycja Struktury - Zaznacz Okładki")
         edit_win.geometry("600x500")
 
-        analysed_results = {p['numer_strony']: p for p in self.analysed_pages}
-
-        # --- Ramka na checkboxy z przewijaniem ---
+        # --- Jeden Treeview zamiast osobnego Checkbuttona na każdą stronę ---
+        # Treeview to pojedynczy natywny widget z wirtualizowanym rysowaniem,
+        # więc okno otwiera się natychmiast także dla kilkusetstronicowych manifestów.
         main_frame = ttk.Frame(edit_win)
         main_frame.pack(fill="both", expand=True)
 
-        canvas_frame = tk.Canvas(main_frame)
-        scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=canvas_frame.yview)
-        scrollable_frame = ttk.Frame(canvas_frame)
-
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas_frame.configure(scrollregion=canvas_frame.bbox("all"))
-        )
-
-        canvas_frame.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas_frame.configure(yscrollcommand=scrollbar.set)
+        tree = ttk.Treeview(main_frame, columns=('okladka',), show='tree headings', height=25)
+        tree.heading('#0', text='Strona')
+        tree.heading('okladka', text='Okładka')
+        tree.column('okladka', width=80, anchor='center')
 
-        checkbox_vars = {}
+        scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
 
         for i, canvas in enumerate(self.canvases):
             current_page_number = i + 1
             identyfikator = f"Strona {current_page_number} (Etykieta: '{canvas.get('label', '[Brak]')}')"
-            
-            var = tk.BooleanVar()
-            
-            analysed_info = analysed_results.get(current_page_number)
-            if analysed_info:
-                var.set(bool(analysed_info.get("jest_okladka", False)))
-            else:
-                var.set(False)
-            
-            checkbox_vars[current_page_number] = var
-            
-            cb = ttk.Checkbutton(scrollable_frame, text=identyfikator, variable=var)
-            cb.pack(anchor=tk.W, padx=10, pady=2)
 
-        canvas_frame.pack(side="left", fill="both", expand=True)
+            # Pozycja strony w analizowanym zakresie (lub poza nim)
+            k = current_page_number - self.analysed_start_page
+            jest_okladka = bool(self.page_is_cover[k]) if 0 <= k < len(self.page_is_cover) else False
+
+            tree.insert('', 'end', iid=str(current_page_number), text=identyfikator,
+                        values=('✓' if jest_okladka else '',))
+
+        def toggle_row(event):
+            row = tree.identify_row(event.y)
+            if row and tree.identify_column(event.x) == '#1':
+                tree.set(row, 'okladka', '' if tree.set(row, 'okladka') == '✓' else '✓')
+
+        tree.bind('<Button-1>', toggle_row)
+
+        tree.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
-        
+
         # --- Ramka na przyciski na dole ---
         button_frame = ttk.Frame(edit_win)
         button_frame.pack(fill=tk.X, side=tk.BOTTOM, pady=10)
 
         def toggle_all_off():
-            for var in checkbox_vars.values():
-                var.set(False)
+            for iid in tree.get_children():
+                tree.set(iid, 'okladka', '')
 
         selection_buttons_frame = ttk.Frame(button_frame)
         selection_buttons_frame.pack()
-        
+
         ### ZMIANA: Usunięto przycisk "Zaznacz wszystkie", zostawiono tylko "Odznacz wszystkie" ###
         deselect_all_btn = ttk.Button(selection_buttons_frame, text="Odznacz wszystkie", command=toggle_all_off)
         deselect_all_btn.pack(side=tk.LEFT, padx=5)
-        
+
         # --- Przycisk zapisu ---
         save_button = ttk.Button(
             button_frame,
             text="Zapisz manifest.json",
-            command=lambda: self.save_manifest_with_structure(checkbox_vars, edit_win)
+            command=lambda: self.save_manifest_with_structure(tree, edit_win)
         )
         save_button.pack(pady=(10, 0))
 
 
-    def save_manifest_with_structure(self, checkbox_vars, window_to_close):
+    def save_manifest_with_structure(self, tree, window_to_close):
+        if self.manifest_data is None and self.manifest_bytes:
+            # Pełne drzewo dokumentu jest potrzebne dopiero tutaj
+            self.manifest_data = json.loads(self.manifest_bytes)
         if not self.manifest_data:
             self.log("BŁĄD: Brak danych manifestu do zapisu.")
             window_to_close.destroy()
             return
 
-        cover_page_numbers = sorted([num for num, var in checkbox_vars.items() if var.get()])
+        cover_page_numbers = sorted(int(iid) for iid in tree.get_children() if tree.set(iid, 'okladka') == '✓')
 
         if not cover_page_numbers:
             self.log("INFO: Nie zaznaczono żadnych okładek. Zapisuję manifest bez pola 'structures'.")
@@ -380,8 +755,12 @@ class CoverFinderApp:
 
         if file_path:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.manifest_data, f, indent=4, ensure_ascii=False)
+                if orjson is not None:
+                    with open(file_path, 'wb') as f:
+                        f.write(orjson.dumps(self.manifest_data, option=orjson.OPT_INDENT_2))
+                else:
+                    with open(file_path, 'w', encoding='utf-8') as f:
+                        json.dump(self.manifest_data, f, indent=4, ensure_ascii=False)
                 self.log(f"Manifest został pomyślnie zapisany w: {file_path}")
             except Exception as e:
                 self.log(f"BŁĄD: Nie udało się zapisać pliku. Szczegóły: {e}")
@@ -391,16 +770,14 @@ class CoverFinderApp:
         window_to_close.destroy()
 
 if __name__ == "__main__":
-    print(f"Ładowanie modelu: {MODEL_ID}...")
-    try:
-        clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
-        print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
+    # Okno startuje od razu - model ładuje się w tle (patrz CoverFinderApp._load_model),
+    # więc pobieranie manifestu może nakładać się z inicjalizacją modelu.
+    root = tk.Tk()
+    app = CoverFinderApp(root)
 
-        root = tk.Tk()
-        app = CoverFinderApp(root)
-        root.mainloop()
+    def on_close():
+        app.http.close()
+        root.destroy()
 
-    except Exception as e:
-        print(f"\nBŁĄD KRYTYCZNY: Nie udało się załadować lub pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
-        input("Naciśnij Enter, aby zamknąć...")
\ No newline at end of file
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.mainloop()
\ No newline at end of file
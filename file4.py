@@ -4,9 +4,50 @@ import torch
 from transformers import CLIPProcessor, CLIPModel
 import io
 import json
+import os
 import numpy as np
 import cv2
 import pytesseract
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Opcjonalny ONNX Runtime - szybsza ścieżka dla enkodera obrazu
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# Opcjonalna numba - fuzja preprocessingu obrazu na CPU w jeden przebieg
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Opcjonalny orjson - parser JSON w C, manifesty gazet potrafią mieć kilka MB
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def wczytaj_json(response):
+    """Parsuje odpowiedź HTTP z JSON-em - orjson, gdy jest, inaczej stdlib."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+# Ten sam plik cache co pozostałe skrypty - model jest identyczny
+ONNX_PATH = Path.home() / ".cover_finder_vit-h.onnx"
+
+# Jedna sesja HTTP na cały skrypt: keep-alive zamiast nowego TCP+TLS
+# na każdą stronę, pula połączeń i ponawianie przy chwilowych błędach
+SESSION = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=16, pool_maxsize=16,
+    max_retries=requests.adapters.Retry(total=3, backoff_factor=0.3)
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+SESSION.headers.update({"Accept-Encoding": "gzip"})
 
 # 1. Konfiguracja modelu
 MODEL_ID = "laion/CLIP-ViT-H-14-laion2B-s32B-b79K"
@@ -20,49 +61,203 @@ if TESSERACT_CMD_PATH:
 MIN_LARGE_TEXT_HEIGHT_PIXELS = 50
 LARGE_TEXT_TO_NORMAL_RATIO = 4.0
 
-# --- ŁADOWANIE MODELU CLIP ---
-print(f"Ładowanie modelu: {MODEL_ID}...")
-print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
+# Prefiltr przed OCR: strony o bardzo niskiej wariancji Laplasjanu
+# (prawie jednolite, bez ostrych krawędzi tekstu) odpadają bez Tesseracta
+PREFILTER_SZEROKOSC = 512
+PREFILTER_PROG_WARIANCJI = 50.0
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
-try:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
-    print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
-except Exception as e:
-    print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
-    exit()
+
+# Model CLIP ładowany leniwie przez zaladuj_model_clip() - tylko gdy
+# użytkownik wybierze metodę 'clip'. Analiza OCR nie płaci ~3.5 GB RAM
+# i kilkudziesięciu sekund startu, a procesy potomne puli OCR nie
+# importują modelu przy starcie (istotne przy spawn na Windows).
+clip_model = None
+clip_processor = None
+cechy_tekstowe = None
+skala_logitow = None
+
+
+class VisionEncoder(torch.nn.Module):
+    """Wieża wizualna CLIP z projekcją jako jeden moduł do eksportu ONNX."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        return self.visual_projection(self.vision_model(pixel_values)[1])
 
 
-def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
+# Sesja onnxruntime dla enkodera obrazu (None = ścieżka PyTorch)
+sesja_onnx = None
+onnx_input_dtype = np.float32
+
+def zbuduj_sesje_onnx():
+    """Eksportuje enkoder obrazu do ONNX (raz, plik cache w katalogu domowym) i otwiera sesję."""
+    global sesja_onnx, onnx_input_dtype
+    if onnxruntime is None:
+        return
+    try:
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        if not ONNX_PATH.exists():
+            dummy = torch.zeros((1, 3, 224, 224), dtype=dtype, device=device)
+            torch.onnx.export(
+                VisionEncoder(clip_model), dummy, str(ONNX_PATH),
+                opset_version=17,
+                input_names=['pixel_values'], output_names=['image_features'],
+                dynamic_axes={'pixel_values': {0: 'N'}, 'image_features': {0: 'N'}},
+            )
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == "cuda" else ['CPUExecutionProvider']
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sesja_onnx = onnxruntime.InferenceSession(str(ONNX_PATH), sess_options=options, providers=providers)
+        onnx_input_dtype = np.float16 if dtype == torch.float16 else np.float32
+        print("Enkoder obrazu działa przez ONNX Runtime.")
+    except Exception as e:
+        sesja_onnx = None
+        print(f"Info: eksport do ONNX nie powiódł się, używam ścieżki PyTorch. ({e})")
+
+OPISY = [
+    "a photo of a newspaper cover with a title and masthead",
+    "a photo of an internal page with articles and blocks of body tex (not title and masthead)",
+    "a photo of an internal page full of advertisements or announcements (not title and masthead)",
+    "a photo of an internal page with a large illustration or photograph (not title and masthead)",
+    "a photo of a table of contents or an editorial page (not title and masthead)"
+]
+
+def zaladuj_model_clip():
+    """Ładuje model CLIP na żądanie i przygotowuje go do klasyfikacji wsadowej.
+
+    Wywoływane raz, dopiero gdy wybrano metodę 'clip' - uruchomienia z samym
+    OCR w ogóle nie dotykają modelu.
     """
-    Używa modelu CLIP do klasyfikacji wizualnej obrazu.
-    Zwraca słownik z najlepszym opisem i jego prawdopodobieństwem.
+    global clip_model, clip_processor, cechy_tekstowe, skala_logitow
+    if clip_model is not None:
+        return
+
+    print(f"Ładowanie modelu: {MODEL_ID}...")
+    print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
+    try:
+        # safetensors ładuje wagi przez mmap (bez ścieżki pickle torch.load),
+        # a low_cpu_mem_usage unika podwójnej kopii 3.5 GB wag w RAM
+        load_kwargs = {"use_safetensors": True, "low_cpu_mem_usage": True}
+        if device == "cuda":
+            # Połowa precyzji już przy ładowaniu. Na CPU zostajemy przy FP32.
+            load_kwargs["torch_dtype"] = torch.float16
+        clip_model = CLIPModel.from_pretrained(MODEL_ID, **load_kwargs).to(device)
+        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+        clip_model.eval()
+        print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
+    except Exception as e:
+        print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
+        exit()
+
+    zbuduj_sesje_onnx()
+
+    # Kompilacja PyTorch tylko wtedy, gdy ONNX nie jest dostępny
+    if sesja_onnx is None and device == "cuda":
+        clip_model = torch.compile(clip_model, mode="reduce-overhead")
+        # Rozgrzewka na pustym obrazie, żeby pierwsza prawdziwa strona
+        # nie płaciła za czas kompilacji
+        with torch.inference_mode():
+            clip_model.get_image_features(
+                pixel_values=torch.zeros(1, 3, 224, 224, device=device, dtype=torch.float16)
+            )
+
+    # Opisy klas są stałe, więc przepuszczamy je przez enkoder tekstu tylko raz.
+    # Każdy wsad uruchamia już wyłącznie wieżę wizualną i mnożenie macierzy.
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+        _tokeny = clip_processor.tokenizer(OPISY, return_tensors="pt", padding=True).to(device)
+        cechy_tekstowe = clip_model.get_text_features(**_tokeny)
+        cechy_tekstowe = cechy_tekstowe / cechy_tekstowe.norm(dim=-1, keepdim=True)
+        skala_logitow = clip_model.logit_scale.exp()
+
+# Ile stron klasyfikujemy jednym przebiegiem modelu CLIP
+ROZMIAR_WSADU = 8
+
+# Dla CLIP wystarczy 448 px (model i tak zmniejsza do 224x224);
+# OCR potrzebuje pełnej rozdzielczości, więc zostaje przy 1200 px.
+SZEROKOSC_OBRAZU_CLIP = 448
+SZEROKOSC_OBRAZU_OCR = 1200
+
+# Kanoniczne statystyki CLIP do normalizacji pikseli
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _fuzja_rescale_norm(img_u8, mean, std, out):
+        """Rescale (/255), normalizacja i HWC->CHW w jednym przebiegu po pamięci."""
+        for c in numba.prange(3):
+            for y in range(img_u8.shape[0]):
+                for x in range(img_u8.shape[1]):
+                    out[c, y, x] = (img_u8[y, x, c] / 255.0 - mean[c]) / std[c]
+
+def przygotuj_piksele_cpu(obrazy: list) -> torch.Tensor:
+    """Preprocessing CLIP na CPU: resize/crop w PIL + fuzja numba zamiast
+    trzech osobnych przebiegów (rescale, normalizacja, transpozycja) w NumPy."""
+    wsad = np.empty((len(obrazy), 3, 224, 224), dtype=np.float32)
+    for k, img in enumerate(obrazy):
+        img = img.convert("RGB")
+        skala = 224 / min(img.size)
+        img = img.resize((round(img.width * skala), round(img.height * skala)), Image.BICUBIC)
+        lewy = (img.width - 224) // 2
+        gorny = (img.height - 224) // 2
+        img = img.crop((lewy, gorny, lewy + 224, gorny + 224))
+        _fuzja_rescale_norm(np.asarray(img, dtype=np.uint8), CLIP_MEAN, CLIP_STD, wsad[k])
+    return torch.from_numpy(wsad)
+
+def klasyfikuj_obrazy_clip_wsadowo(lista_bajtow: list) -> list:
+    """
+    Używa modelu CLIP do klasyfikacji wizualnej całej paczki obrazów naraz.
+    Jeden przebieg wieży wizualnej dla N stron, porównanie z gotowymi cechami tekstowymi.
+    Zwraca listę słowników z wynikami w kolejności wejścia.
     """
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
-            "a photo of a newspaper cover with a title and masthead",
-            "a photo of an internal page with articles and blocks of body tex (not title and masthead)",
-            "a photo of an internal page full of advertisements or announcements (not title and masthead)",
-            "a photo of an internal page with a large illustration or photograph (not title and masthead)",
-            "a photo of a table of contents or an editorial page (not title and masthead)"
-        ]
-        
-        inputs = clip_processor(text=opisy, images=image, return_tensors="pt", padding=True).to(device)
-
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
-
-        probs = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        
-        najlepszy_indeks = probs.argmax()
-        return {
-            "prawdopodobienstwo": float(probs[najlepszy_indeks]),
-            "jest_okladka": najlepszy_indeks == 0
-        }
+        obrazy = [Image.open(io.BytesIO(b)) for b in lista_bajtow]
+
+        if numba is not None and device == "cpu":
+            piksele_cpu = przygotuj_piksele_cpu(obrazy)
+        else:
+            piksele_cpu = clip_processor.image_processor(obrazy, return_tensors="pt")["pixel_values"]
+
+        if sesja_onnx is not None:
+            surowe = sesja_onnx.run(None, {"pixel_values": piksele_cpu.numpy().astype(onnx_input_dtype)})[0]
+            with torch.inference_mode():
+                cechy_obrazow = torch.from_numpy(surowe).to(device)
+                cechy_obrazow = cechy_obrazow / cechy_obrazow.norm(dim=-1, keepdim=True)
+                logity = skala_logitow * cechy_obrazow @ cechy_tekstowe.T
+        else:
+            piksele = piksele_cpu
+            if device == "cuda":
+                # Przypięta pamięć hosta pozwala na asynchroniczną kopię na GPU
+                piksele = piksele.pin_memory().to(device, non_blocking=True)
+            with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+                cechy_obrazow = clip_model.get_image_features(pixel_values=piksele)
+                cechy_obrazow = cechy_obrazow / cechy_obrazow.norm(dim=-1, keepdim=True)
+                logity = skala_logitow * cechy_obrazow @ cechy_tekstowe.T
+
+        # softmax liczymy w FP32, żeby połowa precyzji nie spłaszczała wyników
+        probs = logity.float().softmax(dim=1).cpu().numpy()
+
+        wyniki = []
+        for wiersz in probs:
+            najlepszy_indeks = wiersz.argmax()
+            wyniki.append({
+                "prawdopodobienstwo": float(wiersz[najlepszy_indeks]),
+                "jest_okladka": najlepszy_indeks == 0
+            })
+        return wyniki
     except Exception as e:
-        return {"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}
+        return [{"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}] * len(lista_bajtow)
+
+
+def _inicjalizuj_tesseract():
+    """Ustawia ścieżkę do Tesseracta w procesie potomnym puli OCR."""
+    if TESSERACT_CMD_PATH:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
 
 
 def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
@@ -72,19 +267,41 @@ def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
     """
     try:
         np_arr = np.frombuffer(image_bytes, np.uint8)
-        img_cv = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img_gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+        # Dekodowanie od razu do skali szarości - Tesseract i tak nie potrzebuje
+        # kolorów, a odpada 3-kanałowy bufor pośredni i przebieg cvtColor
+        img_gray = cv2.imdecode(np_arr, cv2.IMREAD_GRAYSCALE)
+
+        # Tani prefiltr: Laplasjan na pomniejszonej kopii. Strona bez ostrych
+        # krawędzi nie zawiera tekstu - szkoda na nią pełnego przebiegu Tesseracta.
+        skala = PREFILTER_SZEROKOSC / img_gray.shape[1]
+        if skala < 1.0:
+            maly = cv2.resize(img_gray, None, fx=skala, fy=skala, interpolation=cv2.INTER_AREA)
+        else:
+            maly = img_gray
+        if cv2.Laplacian(maly, cv2.CV_32F).var() < PREFILTER_PROG_WARIANCJI:
+            return {"jest_okladka": False, "info": "Odrzucono prefiltrem (brak wyraźnego tekstu)."}
+
         ocr_data = pytesseract.image_to_data(img_gray, lang='pol', output_type=pytesseract.Output.DICT)
-        
-        all_heights = [ocr_data['height'][i] for i, conf in enumerate(ocr_data['conf']) if int(conf) > 60 and ocr_data['text'][i].strip()]
 
-        if not all_heights:
+        # Filtrowanie i zliczanie na maskach NumPy zamiast pętli w Pythonie -
+        # dla gęstych stron to tysiące słów na stronę
+        heights = np.asarray(ocr_data['height'], dtype=np.int32)
+        # conf bywa int lub str zależnie od wersji pytesseract - float32 łyka oba
+        confs = np.asarray(ocr_data['conf'], dtype=np.float32)
+        texts_arr = np.asarray(ocr_data['text'], dtype=str)
+        mask = (confs > 60) & (np.char.str_len(np.char.strip(texts_arr)) > 0)
+        all_heights = heights[mask]
+
+        if all_heights.size == 0:
             return {"jest_okladka": False, "info": "Nie znaleziono tekstu na stronie."}
 
         median_height = np.median(all_heights)
-        
-        large_text_count = sum(1 for h in all_heights if h > MIN_LARGE_TEXT_HEIGHT_PIXELS or h > (median_height * LARGE_TEXT_TO_NORMAL_RATIO))
-        
+
+        large_text_count = int(np.count_nonzero(
+            (all_heights > MIN_LARGE_TEXT_HEIGHT_PIXELS)
+            | (all_heights > median_height * LARGE_TEXT_TO_NORMAL_RATIO)
+        ))
+
         return {
             "jest_okladka": large_text_count > 0,
             # Dla OCR prawdopodobieństwo jest binarne - albo znaleziono nagłówek, albo nie.
@@ -101,7 +318,7 @@ def analizuj_manifest(manifest_url: str, metoda_analizy: str, limit_stron: int):
     print("="*80)
     
     try:
-        manifest_data = requests.get(manifest_url).json()
+        manifest_data = wczytaj_json(SESSION.get(manifest_url))
         canvases = manifest_data.get('sequences', [{}])[0].get('canvases', [])
     except Exception as e:
         print(f"BŁĄD KRYTYCZNY: Nie udało się pobrać lub przetworzyć manifestu: {e}")
@@ -113,47 +330,78 @@ def analizuj_manifest(manifest_url: str, metoda_analizy: str, limit_stron: int):
     
     print(f"Rozpoczynam analizę {limit_stron} z {len(canvases)} dostępnych stron...")
 
-    znalezione_okladki = [] 
+    znalezione_okladki = []
+    canvases_do_analizy = canvases[:limit_stron]
+    batch_danych = []  # (numer strony, etykieta, bajty obrazu) czekające na wsad CLIP
+    zadania_ocr = []   # (numer strony, etykieta, bajty obrazu) dla puli procesów OCR
+
+    def zbierz_wynik(numer_strony, etykieta, wynik_analizy):
+        """Dopisuje stronę do listy okładek albo raportuje błąd analizy."""
+        if "błąd" in wynik_analizy:
+            print(f"   [BŁĄD ANALIZY] Strona {numer_strony}: {wynik_analizy['błąd']}")
+            return
+        if wynik_analizy.get('jest_okladka'):
+            identyfikator_strony = f"Strona {numer_strony} (Etykieta: '{etykieta}')"
+            znalezione_okladki.append({
+                "identyfikator": identyfikator_strony,
+                "prawdopodobienstwo": wynik_analizy.get('prawdopodobienstwo', 0.0)
+            })
 
-    for i, canvas in enumerate(canvases[:limit_stron]):
+    def przetworz_wsad_clip():
+        """Klasyfikuje zebrany wsad i zbiera znalezione okładki."""
+        wyniki_wsadu = klasyfikuj_obrazy_clip_wsadowo([dane[2] for dane in batch_danych])
+        for (numer_strony, etykieta, _), wynik_analizy in zip(batch_danych, wyniki_wsadu):
+            zbierz_wynik(numer_strony, etykieta, wynik_analizy)
+        batch_danych.clear()
+
+    for i, canvas in enumerate(canvases_do_analizy):
         label = canvas.get('label', '[Brak etykiety]')
         image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-        
+
         print(f"  Analizuję stronę {i+1}/{limit_stron} ('{label}')...")
 
         if not image_service_url:
             print("   -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
             continue
 
-        image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-        
+        szerokosc = SZEROKOSC_OBRAZU_CLIP if metoda_analizy == 'clip' else SZEROKOSC_OBRAZU_OCR
+        image_url = f"{image_service_url.rstrip('/')}/full/{szerokosc},/0/default.jpg"
+
         try:
-            response = requests.get(image_url, timeout=30)
+            response = SESSION.get(image_url, timeout=30)
             response.raise_for_status()
             image_bytes = response.content
-            
-            wynik_analizy = {}
+
             if metoda_analizy == 'clip':
-                wynik_analizy = klasyfikuj_obraz_clip(image_bytes)
+                # Zbieramy strony do paczki - klasyfikacja odbywa się wsadowo
+                batch_danych.append((i + 1, label, image_bytes))
             elif metoda_analizy == 'ocr':
-                wynik_analizy = analizuj_strukture_tekstu_ocr(image_bytes)
-
-            if "błąd" in wynik_analizy:
-                print(f"   [BŁĄD ANALIZY] {wynik_analizy['błąd']}")
-                continue
-            
-            if wynik_analizy.get('jest_okladka'):
-                identyfikator_strony = f"Strona {i+1} (Etykieta: '{label}')"
-                znalezione_okladki.append({
-                    "identyfikator": identyfikator_strony,
-                    "prawdopodobienstwo": wynik_analizy.get('prawdopodobienstwo', 0.0)
-                })
+                # OCR odkładamy do puli procesów - Tesseract skaluje się na rdzenie
+                zadania_ocr.append((i + 1, label, image_bytes))
 
         except requests.exceptions.RequestException as e:
             print(f"   BŁĄD: Nie udało się pobrać obrazu dla strony {i+1}: {e}")
         except Exception as e:
             print(f"   BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony {i+1}: {e}")
 
+        # Paczka pełna - uruchamiamy klasyfikację wsadu
+        if len(batch_danych) == ROZMIAR_WSADU:
+            przetworz_wsad_clip()
+
+    # Ostatnia, niepełna paczka - flush poza pętlą, bo strony bez linku do
+    # obrazu przeskakują resztę obrotu przez continue
+    if batch_danych:
+        przetworz_wsad_clip()
+
+    # Cała analiza OCR równolegle - po jednym zadaniu na stronę, tyle
+    # procesów, ile rdzeni. CLIP zostaje w procesie głównym (jedno GPU).
+    if zadania_ocr:
+        print(f"\nUruchamiam OCR dla {len(zadania_ocr)} stron na {os.cpu_count()} procesach...")
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_inicjalizuj_tesseract) as pula_ocr:
+            wyniki_ocr = pula_ocr.map(analizuj_strukture_tekstu_ocr, [dane[2] for dane in zadania_ocr])
+            for (numer_strony, etykieta, _), wynik_analizy in zip(zadania_ocr, wyniki_ocr):
+                zbierz_wynik(numer_strony, etykieta, wynik_analizy)
+
     # --- PODSUMOWANIE ---
     print("\n" + "#"*80)
     print(f"### PODSUMOWANIE ANALIZY (METODA: {metoda_analizy.upper()}) ###")
@@ -186,7 +434,7 @@ if __name__ == "__main__":
     # --- Pobranie informacji o manifeście przed pytaniami do użytkownika ---
     try:
         print(f"Pobieranie informacji z manifestu: {MANIFEST_DO_ANALIZY_1}")
-        manifest_data = requests.get(MANIFEST_DO_ANALIZY_1).json()
+        manifest_data = wczytaj_json(SESSION.get(MANIFEST_DO_ANALIZY_1))
         canvases = manifest_data.get('sequences', [{}])[0].get('canvases', [])
         liczba_dostepnych_stron = len(canvases)
         if liczba_dostepnych_stron == 0:
@@ -204,6 +452,10 @@ if __name__ == "__main__":
         if wybrana_metoda not in ['ocr', 'clip']:
             print("Nieprawidłowy wybór. Proszę wpisać 'ocr' lub 'clip'.")
 
+    # Model ładujemy dopiero teraz - analiza OCR obywa się bez niego
+    if wybrana_metoda == 'clip':
+        zaladuj_model_clip()
+
     limit_stron_do_analizy = 0
     while limit_stron_do_analizy <= 0 or limit_stron_do_analizy > liczba_dostepnych_stron:
         try:
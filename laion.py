@@ -1,52 +1,196 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 import torch
+from torchvision.io import decode_jpeg, ImageReadMode
+from torchvision.transforms import v2
 from transformers import CLIPProcessor, CLIPModel
 import io
+import shutil
+import hashlib
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # 1. Konfiguracja modelu
 MODEL_ID = "laion/CLIP-ViT-H-14-laion2B-s32B-b79K"
 
+# Jedna sesja HTTP na cały skrypt - keep-alive zamiast nowego połączenia TLS na każdą stronę
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                       max_retries=Retry(total=2, backoff_factor=0.3))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers.update({"Accept-Encoding": "gzip"})
+
+# Ile obrazów pobieramy równolegle
+LICZBA_WATKOW_POBIERANIA = 8
+
+# CLIP i tak zmniejsza obraz do 224x224, więc nie ma sensu ściągać 1200 px;
+# 400 px to kilkukrotnie mniej bajtów z serwera IIIF bez wpływu na wynik
+SZEROKOSC_OBRAZU = 400
+
+# Cechy obrazu zależą tylko od adresu URL (zawiera też rozmiar), więc trzymamy
+# je na dysku - ponowna analiza tego samego manifestu omija i sieć, i ViT-a
+KATALOG_CACHE_CECH = Path("./clip_emb_cache")
+KATALOG_CACHE_CECH.mkdir(exist_ok=True)
+
+def sciezka_cache_cech(image_url: str) -> Path:
+    """Zwraca ścieżkę pliku cache cech obrazu dla danego adresu URL."""
+    klucz = hashlib.blake2b(image_url.encode("utf-8"), digest_size=16).hexdigest()
+    return KATALOG_CACHE_CECH / f"{klucz}.npy"
+
 # --- ŁADOWANIE MODELU CLIP ---
-print(f"Ładowanie modelu: {MODEL_ID}...")
-print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
 device = "cuda" if torch.cuda.is_available() else "cpu"
-try:
-    # Ładowanie modelu i procesora CLIP z biblioteki transformers
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
+
+# Uchwyty wypełniane przez zaladuj_model() - ładowanie odpalamy w tle z __main__,
+# żeby sekundy wczytywania wag nakładały się na pytania do użytkownika
+clip_model = None
+clip_processor = None
+cechy_tekstowe = None
+skala_logitow = None
+
+
+OPISY = [
+    "a photo of a newspaper cover with a title and masthead",
+    "a photo of an internal page with articles and blocks of body text (not title and masthead)",
+    "a photo of an internal page full of advertisements or announcements (not title and masthead)",
+    "a photo of an internal page with a large illustration or photograph (not title and masthead)",
+    "a photo of a table of contents or an editorial page (not title and masthead)"
+]
+
+# Opisy są stałe dla całej analizy - kodujemy je enkoderem tekstu tylko raz,
+# a każdy wsad stron uruchamia już wyłącznie enkoder obrazu i jedno mnożenie macierzy.
+# Wynik trzymamy też na dysku, żeby kolejne uruchomienia pominęły enkoder tekstu całkowicie.
+PLIK_CACHE_TEKSTU = Path("./clip_text_cache.pt")
+_klucz_cache = hashlib.sha256("\n".join([MODEL_ID] + OPISY).encode("utf-8")).hexdigest()
+
+# Ile stron klasyfikujemy jednym przebiegiem modelu
+ROZMIAR_WSADU = 16
+
+def zaladuj_model():
+    """Ładuje model CLIP, cechy tekstowe i kompiluje wieżę wizualną.
+
+    Funkcja jest uruchamiana w tle z __main__, więc ładowanie wag nakłada się
+    na pobieranie manifestu i pytania do użytkownika. Błąd jest zgłaszany
+    wyjątkiem - obsługuje go wątek główny przy odbiorze wyniku.
+    """
+    global clip_model, clip_processor, cechy_tekstowe, skala_logitow
+
+    print(f"Ładowanie modelu: {MODEL_ID}...")
+    print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
+    # Na GPU trzymamy wagi w FP16 - połowa pamięci i szybsze mnożenia macierzy
+    opcje_ladowania = {"torch_dtype": torch.float16} if device == "cuda" else {}
+    clip_model = CLIPModel.from_pretrained(MODEL_ID, **opcje_ladowania).to(device)
     clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
     print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
-except Exception as e:
-    print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
-    exit()
 
+    if PLIK_CACHE_TEKSTU.exists():
+        try:
+            _zapis = torch.load(PLIK_CACHE_TEKSTU, map_location=device)
+            if _zapis.get("klucz") == _klucz_cache:
+                cechy_tekstowe = _zapis["cechy"].to(device)
+                skala_logitow = _zapis["skala"].to(device)
+        except Exception:
+            cechy_tekstowe = None  # uszkodzony cache - liczymy od nowa
+
+    if cechy_tekstowe is None:
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+            _tokeny = clip_processor(text=OPISY, return_tensors="pt", padding=True).to(device)
+            cechy_tekstowe = clip_model.get_text_features(**_tokeny)
+            cechy_tekstowe = cechy_tekstowe / cechy_tekstowe.norm(dim=-1, keepdim=True)
+            skala_logitow = clip_model.logit_scale.exp()
+        try:
+            torch.save({"klucz": _klucz_cache, "cechy": cechy_tekstowe.cpu(), "skala": skala_logitow.cpu()}, PLIK_CACHE_TEKSTU)
+        except Exception:
+            pass  # brak możliwości zapisu cache nie przerywa analizy
+
+    # Kompilacja samej wieży wizualnej - to ona zjada cały czas inferencji.
+    # dynamic=False zakłada stały kształt wsadu, więc ostatnią paczkę dopełniamy zerami
+    if device == "cuda":
+        try:
+            clip_model.vision_model = torch.compile(clip_model.vision_model, mode="reduce-overhead",
+                                                    fullgraph=False, dynamic=False)
+            print("Rozgrzewka skompilowanego modelu...")
+            with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16):
+                _atrapa = torch.zeros(ROZMIAR_WSADU, 3, 224, 224, device=device)
+                clip_model.get_image_features(pixel_values=_atrapa)
+        except Exception as e:
+            print(f"UWAGA: torch.compile niedostępne ({e}) - kontynuuję bez kompilacji.")
+
+# Preprocessing torchvision zamiast CLIPProcessor - na CUDA dekodowanie JPEG
+# i cała normalizacja dzieją się na GPU (nvJPEG), CPU tylko podaje bajty
+CLIP_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_STD = [0.26862954, 0.26130258, 0.27577711]
+potok_wstepny = v2.Compose([
+    v2.Resize(224, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+    v2.CenterCrop(224),
+    v2.ToDtype(torch.float32, scale=True),
+    v2.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+])
+
+def przygotuj_tensor_obrazu(image_bytes: bytes) -> torch.Tensor:
+    """Dekoduje JPEG (na GPU, jeśli dostępne) i zwraca znormalizowany tensor 3x224x224."""
+    try:
+        dane = torch.frombuffer(image_bytes, dtype=torch.uint8)
+        obraz = decode_jpeg(dane, mode=ImageReadMode.RGB, device=device)
+    except Exception:
+        # Nie-JPEG albo brak nvJPEG - dekodujemy przez PIL
+        obraz_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        obraz = v2.functional.pil_to_tensor(obraz_pil)
+        if device == "cuda":
+            obraz = obraz.pin_memory().to(device, non_blocking=True)
+    return potok_wstepny(obraz)
 
-def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
+def policz_cechy_obrazow(lista_bajtow: list) -> np.ndarray:
     """
-    Używa modelu CLIP do klasyfikacji wizualnej obrazu.
-    Zwraca słownik z najlepszym opisem i jego prawdopodobieństwem.
+    Jeden przebieg enkodera obrazu dla całej paczki stron.
+    Zwraca znormalizowane cechy CLIP jako macierz float16 (N x wymiar).
     """
-    try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
-            "a photo of a newspaper cover with a title and masthead",
-            "a photo of an internal page with articles and blocks of body text (not title and masthead)",
-            "a photo of an internal page full of advertisements or announcements (not title and masthead)",
-            "a photo of an internal page with a large illustration or photograph (not title and masthead)",
-            "a photo of a table of contents or an editorial page (not title and masthead)"
-        ]
-        inputs = clip_processor(text=opisy, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        najlepszy_indeks = probs.argmax()
-        return {
-            "prawdopodobienstwo": float(probs[najlepszy_indeks]),
+    piksele = torch.stack([przygotuj_tensor_obrazu(b) for b in lista_bajtow])
+    liczba_obrazow = piksele.shape[0]
+    if device == "cuda" and liczba_obrazow < ROZMIAR_WSADU:
+        # Skompilowany graf oczekuje pełnego wsadu - dopełniamy i odcinamy wynik
+        dopelnienie = torch.zeros(ROZMIAR_WSADU - liczba_obrazow, *piksele.shape[1:],
+                                  device=piksele.device, dtype=piksele.dtype)
+        piksele = torch.cat([piksele, dopelnienie])
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+        cechy_obrazow = clip_model.get_image_features(pixel_values=piksele)
+        cechy_obrazow = cechy_obrazow / cechy_obrazow.norm(dim=-1, keepdim=True)
+    return cechy_obrazow.float().cpu().numpy().astype(np.float16)[:liczba_obrazow]
+
+def klasyfikuj_cechy(cechy: np.ndarray) -> list:
+    """Zamienia gotowe cechy obrazów (N x wymiar) na werdykty okładka/nie-okładka."""
+    with torch.inference_mode():
+        cechy_t = torch.from_numpy(cechy.astype(np.float32)).to(device)
+        logity = skala_logitow.float() * cechy_t @ cechy_tekstowe.float().T
+        # Softmax jest monotoniczny, więc zwycięzcę wybieramy argmaxem na samych
+        # logitach jeszcze na GPU. Softmax (w FP32 - przy FP16 różnice potrafią
+        # się zlewać) liczymy tylko po to, by odczytać pewność wybranej klasy,
+        # i ściągamy na CPU dwa krótkie wektory zamiast całej macierzy
+        najlepsze_indeksy = logity.argmax(dim=1)
+        pewnosci = logity.softmax(dim=1).gather(1, najlepsze_indeksy.unsqueeze(1)).squeeze(1)
+        najlepsze_indeksy = najlepsze_indeksy.cpu().numpy()
+        pewnosci = pewnosci.cpu().numpy()
+    wyniki = []
+    for najlepszy_indeks, pewnosc in zip(najlepsze_indeksy, pewnosci):
+        wyniki.append({
+            "prawdopodobienstwo": float(pewnosc),
             "jest_okladka": najlepszy_indeks == 0
-        }
-    except Exception as e:
-        return {"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}
+        })
+    return wyniki
+
+
+def pobierz_obraz(image_url: str) -> memoryview:
+    """Pobiera pojedynczy obraz, strumieniując go prosto do bufora w pamięci."""
+    with SESSION.get(image_url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True  # rozpakuj ewentualny gzip po drodze
+        bufor = io.BytesIO()
+        shutil.copyfileobj(response.raw, bufor, length=65536)
+    # getbuffer() to memoryview - dekodery czytają bufor bez dodatkowej kopii
+    return bufor.getbuffer()
 
 
 def analizuj_strony(canvases: list, limit_stron: int, manifest_url: str):
@@ -59,42 +203,90 @@ def analizuj_strony(canvases: list, limit_stron: int, manifest_url: str):
     print("="*80)
 
     znalezione_okladki = []
+    batch_danych = []  # elementy: (numer_strony, etykieta, bajty_obrazu, sciezka_cache)
+
+    def zbierz_wynik(numer, etykieta, wynik_analizy):
+        """Dopisuje stronę do listy okładek, jeśli klasyfikacja na to wskazuje."""
+        if "błąd" in wynik_analizy:
+            print(f"   [BŁĄD ANALIZY] Strona {numer}: {wynik_analizy['błąd']}")
+            return
+        if wynik_analizy.get('jest_okladka'):
+            identyfikator_strony = f"Strona {numer} (Etykieta: '{etykieta}')"
+            znalezione_okladki.append({
+                "identyfikator": identyfikator_strony,
+                "prawdopodobienstwo": wynik_analizy.get('prawdopodobienstwo', 0.0)
+            })
+            print(f"   -> ZNALEZIONO OKŁADKĘ na stronie {numer}! (Prawdopodobieństwo: {wynik_analizy.get('prawdopodobienstwo', 0.0):.2%})")
+
+    def przetworz_wsad():
+        """Liczy cechy zebranego wsadu stron, zapisuje je do cache i dopisuje okładki."""
+        if not batch_danych:
+            return
+        try:
+            cechy = policz_cechy_obrazow([dane[2] for dane in batch_danych])
+        except Exception as e:
+            for numer, _, _, _ in batch_danych:
+                print(f"   [BŁĄD ANALIZY] Strona {numer}: Błąd przetwarzania obrazu z CLIP: {e}")
+            batch_danych.clear()
+            return
+        for (numer, etykieta, _, sciezka_cech), wiersz in zip(batch_danych, cechy):
+            try:
+                np.save(sciezka_cech, wiersz)
+            except Exception:
+                pass  # brak możliwości zapisu cache nie przerywa analizy
+        for (numer, etykieta, _, _), wynik_analizy in zip(batch_danych, klasyfikuj_cechy(cechy)):
+            zbierz_wynik(numer, etykieta, wynik_analizy)
+        batch_danych.clear()
 
+    # Jeden przebieg wstępny po manifeście: strony bez linku do serwisu obrazu
+    # odsiewamy od razu, więc do potoku wsadowego trafia już czysta lista zadań
+    # i żaden wsad nie jest sztucznie urywany przez pominiętą stronę
+    zadania_wstepne = []  # elementy: (numer_strony, etykieta, adres obrazu)
     for i, canvas in enumerate(canvases[:limit_stron]):
         label = canvas.get('label', '[Brak etykiety]')
         image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-        
-        print(f"Analizuję stronę: {i+1}/{limit_stron} (Etykieta: '{label}')")
 
         if not image_service_url:
-            print("   -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
+            print(f"Strona {i + 1}/{limit_stron} (Etykieta: '{label}') -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
             continue
 
-        image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-        
-        try:
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            image_bytes = response.content
-            
-            wynik_analizy = klasyfikuj_obraz_clip(image_bytes)
+        zadania_wstepne.append((i + 1, label, f"{image_service_url.rstrip('/')}/full/{SZEROKOSC_OBRAZU},/0/default.jpg"))
 
-            if "błąd" in wynik_analizy:
-                print(f"   [BŁĄD ANALIZY] {wynik_analizy['błąd']}")
-                continue
-            
-            if wynik_analizy.get('jest_okladka'):
-                identyfikator_strony = f"Strona {i+1} (Etykieta: '{label}')"
-                znalezione_okladki.append({
-                    "identyfikator": identyfikator_strony,
-                    "prawdopodobienstwo": wynik_analizy.get('prawdopodobienstwo', 0.0)
-                })
-                print(f"   -> ZNALEZIONO OKŁADKĘ! (Prawdopodobieństwo: {wynik_analizy.get('prawdopodobienstwo', 0.0):.2%})")
+    # Pobieranie idzie równolegle w puli wątków; klasyfikacja konsumuje wyniki
+    # w kolejności stron, więc wyjście wygląda jak w wersji sekwencyjnej
+    with ThreadPoolExecutor(max_workers=LICZBA_WATKOW_POBIERANIA) as pula_pobierania:
+        zadania = []  # elementy: (numer_strony, etykieta, sciezka_cache, future albo None)
+        for numer, label, image_url in zadania_wstepne:
+            sciezka_cech = sciezka_cache_cech(image_url)
+            if sciezka_cech.exists():
+                # Trafienie w cache - strona nie wymaga ani pobierania, ani enkodera obrazu
+                zadania.append((numer, label, sciezka_cech, None))
+            else:
+                zadania.append((numer, label, sciezka_cech, pula_pobierania.submit(pobierz_obraz, image_url)))
 
-        except requests.exceptions.RequestException as e:
-            print(f"   BŁĄD: Nie udało się pobrać obrazu dla strony {i+1}: {e}")
-        except Exception as e:
-            print(f"   BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony {i+1}: {e}")
+        for numer, label, sciezka_cech, future_pobrania in zadania:
+            print(f"Analizuję stronę: {numer}/{limit_stron} (Etykieta: '{label}')")
+
+            try:
+                if future_pobrania is None:
+                    # Cechy z dysku - zostaje tylko tanie mnożenie z cechami tekstu
+                    cechy = np.load(sciezka_cech)
+                    zbierz_wynik(numer, label, klasyfikuj_cechy(cechy[np.newaxis, :])[0])
+                    continue
+
+                batch_danych.append((numer, label, future_pobrania.result(), sciezka_cech))
+
+                # Klasyfikacja dopiero po zebraniu pełnego wsadu
+                if len(batch_danych) >= ROZMIAR_WSADU:
+                    przetworz_wsad()
+
+            except requests.exceptions.RequestException as e:
+                print(f"   BŁĄD: Nie udało się pobrać obrazu dla strony {numer}: {e}")
+            except Exception as e:
+                print(f"   BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony {numer}: {e}")
+
+    # Ostatni, niepełny wsad
+    przetworz_wsad()
 
     # --- PODSUMOWANIE ---
     print("\n" + "#"*80)
@@ -113,7 +305,12 @@ def analizuj_strony(canvases: list, limit_stron: int, manifest_url: str):
 
 
 if __name__ == "__main__":
-    
+
+    # Model ładuje się w tle - użytkownik w tym czasie wpisuje link i liczbę
+    # stron, a manifest schodzi z sieci; czekamy na wagi dopiero przed analizą
+    pula_ladowania = ThreadPoolExecutor(max_workers=1)
+    przyszlosc_modelu = pula_ladowania.submit(zaladuj_model)
+
     # --- ETAP 1: Pytanie o link i pobranie manifestu ---
     manifest_url_uzytkownika = ""
     canvases = []
@@ -127,7 +324,7 @@ if __name__ == "__main__":
 
         try:
             print(f"\nPobieranie informacji z manifestu: {manifest_url_uzytkownika}...")
-            response = requests.get(manifest_url_uzytkownika, timeout=20)
+            response = SESSION.get(manifest_url_uzytkownika, timeout=20)
             response.raise_for_status() # Sprawdza, czy zapytanie HTTP się powiodło
             manifest_data = response.json()
             canvases = manifest_data.get('sequences', [{}])[0].get('canvases', [])
@@ -165,6 +362,13 @@ if __name__ == "__main__":
             print("BŁĄD: Nieprawidłowa wartość. Proszę podać liczbę całkowitą.")
     
     # --- ETAP 3: Uruchomienie właściwej analizy ---
+    try:
+        przyszlosc_modelu.result()
+    except Exception as e:
+        print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
+        exit()
+    pula_ladowania.shutdown()
+
     analizuj_strony(canvases, limit_stron=limit_stron_uzytkownika, manifest_url=manifest_url_uzytkownika)
 
 
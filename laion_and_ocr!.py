@@ -1,9 +1,16 @@
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
 import torch
+from torchvision.transforms import v2
 from transformers import CLIPProcessor, CLIPModel
-import io
 import json
+import io
+import shutil
+import hashlib
+from pathlib import Path
 import numpy as np
 import cv2
 import pytesseract
@@ -12,81 +19,308 @@ import pytesseract
 ### ZMIANA ### Zmieniamy ID modelu na potężny wariant OpenCLIP
 MODEL_ID = "laion/CLIP-ViT-H-14-laion2B-s32B-b79K"
 
+# Jedna sesja HTTP na cały skrypt - keep-alive zamiast nowego połączenia TLS na każdą stronę
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                       max_retries=Retry(total=2, backoff_factor=0.3))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers.update({"Accept-Encoding": "gzip"})
+
+# Ile obrazów pobieramy równolegle
+LICZBA_WATKOW_POBIERANIA = 8
+
+# Jedno pobranie 1200 px obsługuje i CLIP, i OCR - progi wysokości tekstu
+# (MIN_LARGE_TEXT_HEIGHT_PIXELS) są skalibrowane właśnie pod tę szerokość
+SZEROKOSC_OBRAZU = 1200
+
 # 2. Konfiguracja Tesseract OCR
 TESSERACT_CMD_PATH = "C:\\Users\\praktyka\\AppData\\Local\\Programs\\Tesseract-OCR\\tesseract.exe"
 if TESSERACT_CMD_PATH:
     pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
 
+# PaddleOCR (opcjonalny) - sama detekcja ramek tekstu na GPU jest o rzędy
+# wielkości szybsza niż pełny Tesseract, a heurystyce wystarczą wysokości ramek
+try:
+    from paddleocr import PaddleOCR
+except ImportError:
+    PaddleOCR = None
+
 # 3. Konfiguracja heurystyki dla OCR
 MIN_LARGE_TEXT_HEIGHT_PIXELS = 50
 LARGE_TEXT_TO_NORMAL_RATIO = 4.0
 
+# Heurystyce wystarczą statystyki wysokości tekstu, a czas Tesseracta rośnie
+# mniej więcej liniowo z liczbą pikseli - dłuższy bok zmniejszamy do 800 px
+MAKS_BOK_OCR = 800
+
 # --- ŁADOWANIE MODELU CLIP ---
 ### ZMIANA ### Aktualizujemy logikę ładowania z powrotem na klasy CLIP
-print(f"Ładowanie modelu: {MODEL_ID}...")
-print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
 device = "cuda" if torch.cuda.is_available() else "cpu"
-try:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
-    print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
-except Exception as e:
-    print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
-    exit()
-
-### ZMIANA ### Wracamy do oryginalnej, prostszej funkcji klasyfikującej dla modeli CLIP
-def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
+
+# Model, cechy tekstowe i kompilacja przygotowywane leniwie przez
+# zaladuj_model_clip() - pula OCR to procesy spawn (Windows), które importują
+# ten moduł od nowa, i bez tej osłony każdy proces roboczy ładowałby pełne
+# wagi ViT-H oraz płacił za rozgrzewkę torch.compile przed pierwszym
+# wywołaniem Tesseracta
+clip_model = None
+clip_processor = None
+
+OPISY = [
+    "a photo of a newspaper cover with a title and masthead",
+    "a photo of an internal page with articles and blocks of body tex (not title and masthead)",
+    "a photo of a internal page full of advertisements or announcements (not title and masthead)",
+    "a photo of a internal page with a large illustration or photograph (not title and masthead)",
+    "a photo of a table of contents or an editorial page (not title and masthead)"
+]
+
+# Opisy są stałe, więc enkoder tekstu uruchamiamy tylko raz przy starcie;
+# pętla analizy używa już wyłącznie enkodera obrazu i jednego mnożenia macierzy.
+# Policzone cechy lądują też na dysku - kolejne uruchomienia wczytują je z pliku.
+PLIK_CACHE_TEKSTU = Path("./clip_text_cache.pt")
+_klucz_cache = hashlib.sha256("\n".join([MODEL_ID] + OPISY).encode("utf-8")).hexdigest()
+
+cechy_tekstowe = None
+skala_logitow = None
+
+# Ile stron klasyfikujemy jednym przebiegiem modelu
+ROZMIAR_WSADU = 16
+
+
+def zaladuj_model_clip():
+    """Ładuje model CLIP i przygotowuje cechy tekstowe - raz, tylko w procesie głównym."""
+    global clip_model, clip_processor, cechy_tekstowe, skala_logitow
+    if clip_model is not None:
+        return
+
+    print(f"Ładowanie modelu: {MODEL_ID}...")
+    print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
+    try:
+        # Na GPU trzymamy wagi w FP16 - połowa pamięci i szybsze mnożenia macierzy
+        opcje_ladowania = {"torch_dtype": torch.float16} if device == "cuda" else {}
+        clip_model = CLIPModel.from_pretrained(MODEL_ID, **opcje_ladowania).to(device)
+        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+        print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
+    except Exception as e:
+        print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
+        exit()
+
+    if PLIK_CACHE_TEKSTU.exists():
+        try:
+            _zapis = torch.load(PLIK_CACHE_TEKSTU, map_location=device)
+            if _zapis.get("klucz") == _klucz_cache:
+                cechy_tekstowe = _zapis["cechy"].to(device)
+                skala_logitow = _zapis["skala"].to(device)
+        except Exception:
+            cechy_tekstowe = None  # uszkodzony cache - liczymy od nowa
+
+    if cechy_tekstowe is None:
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+            _tokeny = clip_processor(text=OPISY, return_tensors="pt", padding=True).to(device)
+            cechy_tekstowe = clip_model.get_text_features(**_tokeny)
+            cechy_tekstowe = cechy_tekstowe / cechy_tekstowe.norm(dim=-1, keepdim=True)
+            skala_logitow = clip_model.logit_scale.exp()
+        try:
+            torch.save({"klucz": _klucz_cache, "cechy": cechy_tekstowe.cpu(), "skala": skala_logitow.cpu()}, PLIK_CACHE_TEKSTU)
+        except Exception:
+            pass  # brak możliwości zapisu cache nie przerywa analizy
+
+    # Kompilacja samej wieży wizualnej - to ona zjada cały czas inferencji.
+    # dynamic=False zakłada stały kształt wsadu, więc ostatnią paczkę dopełniamy zerami
+    if device == "cuda":
+        try:
+            clip_model.vision_model = torch.compile(clip_model.vision_model, mode="reduce-overhead",
+                                                    fullgraph=False, dynamic=False)
+            print("Rozgrzewka skompilowanego modelu...")
+            with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16):
+                _atrapa = torch.zeros(ROZMIAR_WSADU, 3, 224, 224, device=device)
+                clip_model.get_image_features(pixel_values=_atrapa)
+        except Exception as e:
+            print(f"UWAGA: torch.compile niedostępne ({e}) - kontynuuję bez kompilacji.")
+
+# Preprocessing torchvision zamiast CLIPProcessor - na CUDA dekodowanie JPEG
+# i cała normalizacja dzieją się na GPU (nvJPEG), CPU tylko podaje bajty
+CLIP_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_STD = [0.26862954, 0.26130258, 0.27577711]
+potok_wstepny = v2.Compose([
+    v2.Resize(224, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+    v2.CenterCrop(224),
+    v2.ToDtype(torch.float32, scale=True),
+    v2.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+])
+
+# Przypięty (pinned) bufor hosta wielokrotnego użytku - pin_memory() przy każdej
+# stronie rejestrowałoby strony pamięci od nowa, co kosztuje więcej niż sama kopia
+_pinned_staging = None
+
+def _przenies_na_gpu(tensor_u8: torch.Tensor) -> torch.Tensor:
+    """Kopiuje tensor uint8 na GPU asynchronicznie przez przypięty bufor hosta."""
+    global _pinned_staging
+    n = tensor_u8.numel()
+    if _pinned_staging is None or _pinned_staging.numel() < n:
+        _pinned_staging = torch.empty(n, dtype=torch.uint8, pin_memory=True)
+    else:
+        # Poprzednia asynchroniczna kopia mogła jeszcze trwać - nie nadpisujemy bufora w locie
+        torch.cuda.current_stream().synchronize()
+    plaski = _pinned_staging[:n]
+    plaski.copy_(tensor_u8.reshape(-1))
+    return plaski.to(device, non_blocking=True).reshape(tensor_u8.shape)
+
+def przygotuj_tensor_obrazu(obraz_rgb: np.ndarray) -> torch.Tensor:
+    """Zamienia zdekodowaną macierz RGB (HWC) na znormalizowany tensor 3x224x224."""
+    obraz = torch.from_numpy(np.ascontiguousarray(obraz_rgb))
+    if device == "cuda":
+        obraz = _przenies_na_gpu(obraz)
+    return potok_wstepny(obraz.permute(2, 0, 1))
+
+### ZMIANA ### Klasyfikacja wsadowa - jeden przebieg modelu dla całej paczki stron
+def klasyfikuj_obrazy_clip_wsadowo(lista_rgb: list) -> list:
     """
-    Używa modelu CLIP do klasyfikacji wizualnej obrazu.
-    Zwraca słownik z najlepszym opisem i jego prawdopodobieństwem.
+    Używa modelu CLIP do klasyfikacji wizualnej paczki zdekodowanych obrazów RGB
+    naraz. Zwraca listę słowników z najlepszym opisem i jego prawdopodobieństwem,
+    w kolejności wejścia.
     """
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
-            "a photo of a newspaper cover with a title and masthead",
-            "a photo of an internal page with articles and blocks of body tex (not title and masthead)",
-            "a photo of a internal page full of advertisements or announcements (not title and masthead)",
-            "a photo of a internal page with a large illustration or photograph (not title and masthead)",
-            "a photo of a table of contents or an editorial page (not title and masthead)"
-        ]
-        teksty_do_modelu = opisy
-
-        # Dla modeli typu CLIP, procesor obsługuje tekst i obraz w jednym wywołaniu
-        inputs = clip_processor(text=teksty_do_modelu, images=image, return_tensors="pt", padding=True).to(device)
-
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
-
-        probs = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        
-        najlepszy_indeks = probs.argmax()
+        piksele = torch.stack([przygotuj_tensor_obrazu(o) for o in lista_rgb])
+        liczba_obrazow = piksele.shape[0]
+        if device == "cuda" and liczba_obrazow < ROZMIAR_WSADU:
+            # Skompilowany graf oczekuje pełnego wsadu - dopełniamy i odcinamy wynik
+            dopelnienie = torch.zeros(ROZMIAR_WSADU - liczba_obrazow, *piksele.shape[1:],
+                                      device=piksele.device, dtype=piksele.dtype)
+            piksele = torch.cat([piksele, dopelnienie])
+
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+            cechy_obrazow = clip_model.get_image_features(pixel_values=piksele)
+            cechy_obrazow = cechy_obrazow / cechy_obrazow.norm(dim=-1, keepdim=True)
+            logity = skala_logitow * cechy_obrazow @ cechy_tekstowe.T
+
+        # Softmax jest monotoniczny, więc zwycięzcę wskazuje argmax na samych
+        # logitach jeszcze na GPU. Softmax (w FP32 - przy FP16 różnice potrafią
+        # się zlewać) służy tylko do odczytu pewności wybranej klasy; na CPU
+        # schodzą dwa krótkie wektory zamiast całej macierzy prawdopodobieństw
+        logity = logity.float()[:liczba_obrazow]
+        najlepsze_indeksy = logity.argmax(dim=1)
+        pewnosci = logity.softmax(dim=1).gather(1, najlepsze_indeksy.unsqueeze(1)).squeeze(1)
+        najlepsze_indeksy = najlepsze_indeksy.cpu().numpy()
+        pewnosci = pewnosci.cpu().numpy()
+
+        wyniki = []
+        for najlepszy_indeks, pewnosc in zip(najlepsze_indeksy, pewnosci):
+            wyniki.append({
+                "kategoria": OPISY[najlepszy_indeks],
+                "prawdopodobienstwo": float(pewnosc),
+                "jest_okladka_wg_clip": najlepszy_indeks == 0
+            })
+        return wyniki
+    except Exception as e:
+        return [{"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}] * len(lista_rgb)
+
+# --- FUNKCJE POMOCNICZE I PĘTLA GŁÓWNA ---
+
+def _inicjalizuj_tesseract():
+    """Ustawia ścieżkę do Tesseracta w procesach roboczych puli OCR."""
+    if TESSERACT_CMD_PATH:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
+
+
+def pobierz_obraz(image_url: str) -> memoryview:
+    """Pobiera pojedynczy obraz, strumieniując go prosto do bufora w pamięci."""
+    with SESSION.get(image_url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True  # rozpakuj ewentualny gzip po drodze
+        bufor = io.BytesIO()
+        shutil.copyfileobj(response.raw, bufor, length=65536)
+    # getbuffer() to memoryview - dekodery czytają bufor bez dodatkowej kopii
+    return bufor.getbuffer()
+
+# Detektor PaddleOCR budowany raz przy starcie; None oznacza ścieżkę Tesseract
+_detektor_paddle = None
+if PaddleOCR is not None:
+    try:
+        _detektor_paddle = PaddleOCR(det=True, rec=False, use_gpu=(device == "cuda"), lang='pl', show_log=False)
+        print("PaddleOCR dostępny - analiza układu tekstu pójdzie przez detektor.")
+    except Exception as e:
+        print(f"Info: nie udało się uruchomić PaddleOCR ({e}) - zostaję przy Tesseract.")
+        _detektor_paddle = None
+
+
+def analizuj_strukture_tekstu_det(img_gray: np.ndarray) -> dict:
+    """
+    Jak analizuj_strukture_tekstu_ocr, ale wysokości bloków bierze z ramek
+    detektora PaddleOCR - bez etapu rozpoznawania znaków.
+    """
+    try:
+        prog_duzego_tekstu = MIN_LARGE_TEXT_HEIGHT_PIXELS
+        najdluzszy_bok = max(img_gray.shape)
+        if najdluzszy_bok > MAKS_BOK_OCR:
+            skala = MAKS_BOK_OCR / najdluzszy_bok
+            img_gray = cv2.resize(img_gray, None, fx=skala, fy=skala, interpolation=cv2.INTER_AREA)
+            prog_duzego_tekstu = MIN_LARGE_TEXT_HEIGHT_PIXELS * skala
+
+        detekcje = _detektor_paddle.ocr(img_gray, det=True, rec=False, cls=False)
+        ramki = detekcje[0] if detekcje else None
+        if not ramki:
+            return {"znaleziono_duzy_tekst": False, "info": "Nie znaleziono tekstu na stronie."}
+
+        punkty = np.asarray(ramki, dtype=np.float32)  # (N ramek, 4 rogi, 2 wsp.)
+        all_heights = punkty[:, :, 1].max(axis=1) - punkty[:, :, 1].min(axis=1)
+
+        median_height = np.median(all_heights)
+        maska_duzych = (all_heights > prog_duzego_tekstu) | (all_heights > median_height * LARGE_TEXT_TO_NORMAL_RATIO)
+        large_text_count = int(np.count_nonzero(maska_duzych))
+
         return {
-            "kategoria": opisy[najlepszy_indeks],
-            "prawdopodobienstwo": probs[najlepszy_indeks],
-            "jest_okladka_wg_clip": najlepszy_indeks == 0
+            "znaleziono_duzy_tekst": large_text_count > 0,
+            "liczba_duzych_blokow": large_text_count,
+            "mediana_wysokosci_tekstu": round(float(median_height), 2)
         }
     except Exception as e:
-        return {"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}
+        return {"błąd": f"Błąd podczas analizy detektorem: {e}"}
 
-# --- FUNKCJE POMOCNICZE I PĘTLA GŁÓWNA (BEZ ZMIAN) ---
 
-def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
+def analizuj_strukture_tekstu_ocr(img_gray: np.ndarray) -> dict:
+    """Analizuje strukturę tekstu na już zdekodowanej macierzy w odcieniach szarości."""
     try:
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img_cv = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img_gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        ocr_data = pytesseract.image_to_data(img_gray, lang='pol', output_type=pytesseract.Output.DICT)
-        
-        all_heights = [ocr_data['height'][i] for i, conf in enumerate(ocr_data['conf']) if int(conf) > 60 and ocr_data['text'][i].strip()]
-
-        if not all_heights:
+        # Zmniejszenie obrazu przed OCR; próg wysokości skalujemy tym samym
+        # współczynnikiem, a mediana jest niezmiennicza względem skali
+        prog_duzego_tekstu = MIN_LARGE_TEXT_HEIGHT_PIXELS
+        najdluzszy_bok = max(img_gray.shape)
+        if najdluzszy_bok > MAKS_BOK_OCR:
+            skala = MAKS_BOK_OCR / najdluzszy_bok
+            img_gray = cv2.resize(img_gray, None, fx=skala, fy=skala, interpolation=cv2.INTER_AREA)
+            prog_duzego_tekstu = MIN_LARGE_TEXT_HEIGHT_PIXELS * skala
+
+        # Bramka przed Tesseractem: natywna analiza spójnych komponentów na
+        # zbinaryzowanym obrazie jest ~100x tańsza od OCR. Jeśli nie widać
+        # choćby dwóch kandydatów na duże glify, werdykt i tak byłby negatywny
+        _, binarny = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        _, _, statystyki, _ = cv2.connectedComponentsWithStats(binarny, connectivity=8)
+        wysokosci_komponentow = statystyki[1:, cv2.CC_STAT_HEIGHT]
+        if int((wysokosci_komponentow > prog_duzego_tekstu).sum()) < 2:
+            return {"znaleziono_duzy_tekst": False,
+                    "info": "Odrzucono bramką komponentów (brak kandydatów na duży tekst)."}
+
+        # --oem 1 wymusza silnik LSTM, --psm 6 stały tryb segmentacji -
+        # Tesseract nie traci czasu na własną autodetekcję układu strony
+        ocr_data = pytesseract.image_to_data(img_gray, lang='pol', config='--oem 1 --psm 6',
+                                             output_type=pytesseract.Output.DICT)
+
+        # Filtrowanie wektorowo w NumPy zamiast pętli po pojedynczych słowach.
+        # Tesseract zwraca conf jako int albo str zależnie od wersji, stąd float32
+        wysokosci = np.asarray(ocr_data['height'], dtype=np.int32)
+        pewnosci = np.asarray(ocr_data['conf'], dtype=np.float32)
+        teksty = np.char.strip(np.asarray(ocr_data['text'], dtype=str))
+        maska = (pewnosci > 60) & (np.char.str_len(teksty) > 0)
+        all_heights = wysokosci[maska]
+
+        if all_heights.size == 0:
             return {"znaleziono_duzy_tekst": False, "info": "Nie znaleziono tekstu na stronie."}
 
         median_height = np.median(all_heights)
-        
-        large_text_count = sum(1 for h in all_heights if h > MIN_LARGE_TEXT_HEIGHT_PIXELS or h > (median_height * LARGE_TEXT_TO_NORMAL_RATIO))
-        
+
+        maska_duzych = (all_heights > prog_duzego_tekstu) | (all_heights > median_height * LARGE_TEXT_TO_NORMAL_RATIO)
+        large_text_count = int(np.count_nonzero(maska_duzych))
+
         return {
             "znaleziono_duzy_tekst": large_text_count > 0,
             "liczba_duzych_blokow": large_text_count,
@@ -102,7 +336,7 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
     print("="*80)
     
     try:
-        manifest_data = requests.get(manifest_url).json()
+        manifest_data = SESSION.get(manifest_url, timeout=20).json()
         canvases = manifest_data.get('sequences', [{}])[0].get('canvases', [])
     except Exception as e:
         print(f"BŁĄD KRYTYCZNY: Nie udało się pobrać lub przetworzyć manifestu: {e}")
@@ -114,36 +348,63 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
     
     print(f"Znaleziono {len(canvases)} stron. Analizuję pierwszych {limit_stron}.")
 
-    wyniki_koncowe_okladki = [] 
+    wyniki_koncowe_okladki = []
     wyniki_clip_okladki = []
     wyniki_ocr_okladki = []
 
-    for i, canvas in enumerate(canvases[:limit_stron]):
-        label = canvas.get('label', '[Brak etykiety]')
-        image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-        
-        print("-" * 60)
-        print(f"Strona {i+1}/{limit_stron}: '{label}'")
-
-        if not image_service_url:
-            print("  -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
-            continue
-
-        image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-        print(f"  Pobieranie obrazu: {image_url}")
+    batch_danych = []  # elementy: (numer_strony, etykieta, bajty_obrazu)
+
+    # Tesseract jest jednowątkowy w obrębie wywołania - strony z jednego wsadu
+    # OCR-ujemy równolegle na osobnych rdzeniach. Przy aktywnym detektorze
+    # PaddleOCR pula nie jest potrzebna - detekcja biegnie w wątku głównym
+    pula_ocr = None
+    if _detektor_paddle is None:
+        pula_ocr = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_inicjalizuj_tesseract)
+
+    def przetworz_wsad():
+        """Klasyfikuje zebrany wsad stron modelem CLIP, po czym analizuje każdą z nich OCR-em."""
+        if not batch_danych:
+            return
+        # Jedno dekodowanie JPEG na stronę - CLIP dostaje widok RGB,
+        # a OCR gotową macierz w odcieniach szarości z tego samego bufora.
+        # imdecode zwraca None dla uszkodzonej albo nieobrazowej odpowiedzi
+        # (np. strona błędu HTML) - taką stronę raportujemy i odsiewamy,
+        # zamiast pozwolić jej wywrócić cały wsad
+        # Wsad zdejmujemy z listy od razu - gdyby analiza mimo wszystko rzuciła,
+        # kolejne wywołania nie będą w kółko przetwarzać tej samej zepsutej paczki
+        wsad = list(batch_danych)
+        batch_danych.clear()
+        wpisy_wsadu = []
+        obrazy_bgr = []
+        for dane in wsad:
+            obraz = cv2.imdecode(np.frombuffer(dane[2], np.uint8), cv2.IMREAD_COLOR)
+            if obraz is None:
+                print("-" * 60)
+                print(f"Strona {dane[0]}/{limit_stron}: '{dane[1]}'")
+                print("  BŁĄD: Nie udało się zdekodować obrazu (uszkodzona lub nieobrazowa odpowiedź).")
+                continue
+            wpisy_wsadu.append(dane)
+            obrazy_bgr.append(obraz)
+        if not wpisy_wsadu:
+            return
+        oceny_clip = klasyfikuj_obrazy_clip_wsadowo(
+            [cv2.cvtColor(obraz, cv2.COLOR_BGR2RGB) for obraz in obrazy_bgr])
+        szarosci = [cv2.cvtColor(obraz, cv2.COLOR_BGR2GRAY) for obraz in obrazy_bgr]
+        if _detektor_paddle is not None:
+            wyniki_ocr = [analizuj_strukture_tekstu_det(szary) for szary in szarosci]
+        else:
+            wyniki_ocr = [pula_ocr.submit(analizuj_strukture_tekstu_ocr, szary) for szary in szarosci]
+
+        for (numer, etykieta, _), ocena_clip, wynik_ocr in zip(wpisy_wsadu, oceny_clip, wyniki_ocr):
+            print("-" * 60)
+            print(f"Strona {numer}/{limit_stron}: '{etykieta}'")
 
-        try:
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            image_bytes = response.content
-            
-            ocena_clip = klasyfikuj_obraz_clip(image_bytes)
             if "błąd" in ocena_clip:
                 print(f"  [BŁĄD MODELU] {ocena_clip['błąd']}")
                 continue
             print(f"  > Ocena modelu: '{ocena_clip['kategoria']}' ({ocena_clip['prawdopodobienstwo']:.2%})")
 
-            analiza_ocr = analizuj_strukture_tekstu_ocr(image_bytes)
+            analiza_ocr = wynik_ocr if _detektor_paddle is not None else wynik_ocr.result()
             if "błąd" in analiza_ocr:
                 print(f"  [BŁĄD OCR] {analiza_ocr['błąd']}")
                 continue
@@ -152,16 +413,16 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
             else:
                 print(f"  > Analiza OCR: Nie wykryto dużego tekstu. ({analiza_ocr.get('info', '')})")
 
-            identyfikator_strony = f"Strona {i+1} (Etykieta z manifestu: '{label}')"
+            identyfikator_strony = f"Strona {numer} (Etykieta z manifestu: '{etykieta}')"
 
             if ocena_clip['jest_okladka_wg_clip']:
                 wyniki_clip_okladki.append(identyfikator_strony)
-            
+
             if analiza_ocr['znaleziono_duzy_tekst']:
                 wyniki_ocr_okladki.append(identyfikator_strony)
 
             print("\n  ----------------- WYNIK KOŃCOWY -----------------")
-            
+
             jest_okladka = False
             if analiza_ocr['znaleziono_duzy_tekst']:
                 print("  >>> JEST NAGŁÓWKIEM (Potwierdzone przez analizę struktury tekstu OCR)")
@@ -176,10 +437,49 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
             if jest_okladka:
                 wyniki_koncowe_okladki.append(identyfikator_strony)
 
-        except requests.exceptions.RequestException as e:
-            print(f"  BŁĄD: Nie udało się pobrać obrazu: {e}")
-        except Exception as e:
-            print(f"  BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony: {e}")
+    # Jeden przebieg wstępny po manifeście: strony bez linku do serwisu obrazu
+    # odsiewamy od razu, więc do potoku wsadowego trafia już czysta lista zadań
+    # i żaden wsad nie jest sztucznie urywany przez pominiętą stronę
+    zadania_wstepne = []  # elementy: (numer_strony, etykieta, adres obrazu)
+    for i, canvas in enumerate(canvases[:limit_stron]):
+        label = canvas.get('label', '[Brak etykiety]')
+        image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
+
+        if not image_service_url:
+            print("-" * 60)
+            print(f"Strona {i + 1}/{limit_stron}: '{label}'")
+            print("  -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
+            continue
+
+        zadania_wstepne.append((i + 1, label, f"{image_service_url.rstrip('/')}/full/{SZEROKOSC_OBRAZU},/0/default.jpg"))
+
+    # Pobieranie idzie równolegle w puli wątków; analiza konsumuje wyniki
+    # w kolejności stron, więc wyjście wygląda jak w wersji sekwencyjnej
+    with ThreadPoolExecutor(max_workers=LICZBA_WATKOW_POBIERANIA) as pula_pobierania:
+        zadania = [(numer, label, pula_pobierania.submit(pobierz_obraz, image_url))
+                   for numer, label, image_url in zadania_wstepne]
+
+        for numer, label, future_pobrania in zadania:
+            try:
+                batch_danych.append((numer, label, future_pobrania.result()))
+
+                # Analiza rusza dopiero po zebraniu pełnego wsadu
+                if len(batch_danych) >= ROZMIAR_WSADU:
+                    przetworz_wsad()
+
+            except requests.exceptions.RequestException as e:
+                print(f"  BŁĄD: Nie udało się pobrać obrazu strony {numer}: {e}")
+            except Exception as e:
+                print(f"  BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony {numer}: {e}")
+
+    # Ostatni, niepełny wsad - pod try, żeby podsumowanie wydrukowało się
+    # nawet przy niespodziewanym błędzie analizy
+    try:
+        przetworz_wsad()
+    except Exception as e:
+        print(f"  BŁĄD: Nie udało się przetworzyć ostatniego wsadu: {e}")
+    if pula_ocr is not None:
+        pula_ocr.shutdown()
 
     print("\n" + "#"*80)
     print("### PODSUMOWANIE ANALIZY (WYNIKI SZCZEGÓŁOWE) ###")
@@ -214,8 +514,10 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
 
 if __name__ == "__main__":
     try:
-        pytesseract.get_tesseract_version()
-        print(f"Tesseract OCR jest dostępny (wersja: {pytesseract.get_tesseract_version()}).\n")
+        # Tesseract jest wymagany tylko, gdy nie działa detektor PaddleOCR
+        if _detektor_paddle is None:
+            pytesseract.get_tesseract_version()
+            print(f"Tesseract OCR jest dostępny (wersja: {pytesseract.get_tesseract_version()}).\n")
     except pytesseract.TesseractNotFoundError:
         print("\n" + "!"*80)
         print("BŁĄD KRYTYCZNY: Nie znaleziono Tesseract OCR.")
@@ -223,7 +525,9 @@ if __name__ == "__main__":
         print("!"*80 + "\n")
         exit()
 
-    MANIFEST_DO_ANALIZY_1 = "https://glam.uni.wroc.pl/iiif/GSL_GSL_P_31520_IV_1915_32510/manifest" 
-    
+    zaladuj_model_clip()
+
+    MANIFEST_DO_ANALIZY_1 = "https://glam.uni.wroc.pl/iiif/GSL_GSL_P_31520_IV_1915_32510/manifest"
+
     analizuj_manifest(MANIFEST_DO_ANALIZY_1, limit_stron=15)
 
@@ -1,14 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import requests
-from PIL import Image
 import torch
 from transformers import CLIPProcessor, CLIPModel
-import io
 import json
+import os
 import numpy as np
 import cv2
 import pytesseract
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # --- GŁÓWNA KONFIGURACJA ---
 MODEL_ID = "laion/CLIP-ViT-H-14-laion2B-s32B-b79K"
@@ -19,20 +19,57 @@ if TESSERACT_CMD_PATH:
 MIN_LARGE_TEXT_HEIGHT_PIXELS = 50
 LARGE_TEXT_TO_NORMAL_RATIO = 4.0
 
+# Gdy CLIP jest tak pewny, że strona NIE jest okładką, OCR praktycznie nigdy
+# nie zmienia końcowej decyzji - pomijamy wtedy Tesseracta w całości
+PROG_PEWNOSCI_CLIP = 0.85
+
 # --- ŁADOWANIE MODELU CLIP ---
-print(f"Ładowanie modelu: {MODEL_ID}...")
-print("UWAGA: To bardzo duży model (ok. 2.5 GB).")
 device = "cuda" if torch.cuda.is_available() else "cpu"
-try:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
-    print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
-except Exception as e:
-    print(f"\nBŁĄD KRYTYCZNY: {e}")
-    exit()
-
-# --- FUNKCJE POMOCNICZE (bez zmian) ---
-def klasyfikuj_obraz_clip_wsadowo(images: list) -> list:
+
+# Model ładowany leniwie przez zaladuj_model_clip() - pula OCR to na Windows
+# procesy spawn, które importują ten moduł od nowa, i bez tego każdy proces
+# roboczy wciągałby na start pełne 3.5 GB wag CLIP zanim dotknie Tesseracta
+clip_model = None
+clip_processor = None
+_SREDNIA_CLIP = None
+_ODCHYLENIE_CLIP = None
+
+
+def zaladuj_model_clip():
+    """Ładuje model CLIP raz, wyłącznie w procesie głównym."""
+    global clip_model, clip_processor, _SREDNIA_CLIP, _ODCHYLENIE_CLIP
+    if clip_model is not None:
+        return
+    print(f"Ładowanie modelu: {MODEL_ID}...")
+    print("UWAGA: To bardzo duży model (ok. 2.5 GB).")
+    try:
+        clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
+        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+        print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
+    except Exception as e:
+        print(f"\nBŁĄD KRYTYCZNY: {e}")
+        exit()
+
+    # Stałe normalizacji wyciągnięte z procesora CLIP - własny preprocessing na cv2
+    # omija jednowątkowy, pythonowy potok CLIPProcessor (PIL + rescale w Pythonie)
+    _SREDNIA_CLIP = np.asarray(clip_processor.image_processor.image_mean, dtype=np.float32)
+    _ODCHYLENIE_CLIP = np.asarray(clip_processor.image_processor.image_std, dtype=np.float32)
+
+
+# --- FUNKCJE POMOCNICZE ---
+
+_pula_preprocess = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+def _przygotuj_obraz(image_bytes: bytes) -> np.ndarray:
+    """Dekoduje bajty JPEG i normalizuje obraz do macierzy 224x224x3 float32."""
+    bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    rgb = cv2.resize(rgb, (224, 224), interpolation=cv2.INTER_CUBIC)
+    return (rgb.astype(np.float32) / 255.0 - _SREDNIA_CLIP) / _ODCHYLENIE_CLIP
+
+
+def klasyfikuj_obraz_clip_wsadowo(lista_bajtow: list) -> list:
     """
     ### NOWA FUNKCJA WSADOWA ###
     Używa modelu CLIP do klasyfikacji wizualnej CAŁEJ PACZKI obrazów.
@@ -46,15 +83,20 @@ def klasyfikuj_obraz_clip_wsadowo(images: list) -> list:
             "a photo of an internal page with a large illustration or photograph (not a main title and masthead)",
             "a photo of a table of contents or an editorial page (not a main title and masthead)"
         ]
-        
-        inputs = clip_processor(text=opisy, images=images, return_tensors="pt", padding=True).to(device)
+
+        # Dekodowanie i normalizacja na wątkach (cv2 zwalnia GIL), potem jeden
+        # wspólny tensor NCHW zamiast przepuszczania obrazów PIL przez procesor
+        przygotowane = list(_pula_preprocess.map(_przygotuj_obraz, lista_bajtow))
+        piksele = torch.from_numpy(np.stack(przygotowane)).permute(0, 3, 1, 2).to(device, non_blocking=True)
+
+        wejscia_tekstowe = clip_processor(text=opisy, return_tensors="pt", padding=True).to(device)
         with torch.no_grad():
-            outputs = clip_model(**inputs)
+            outputs = clip_model(pixel_values=piksele, **wejscia_tekstowe)
         logits_per_image = outputs.logits_per_image
         probs = logits_per_image.softmax(dim=1)
-        
+
         wyniki = []
-        for i in range(len(images)):
+        for i in range(len(lista_bajtow)):
             prawdopodobienstwa_obrazu = probs[i].cpu().numpy().flatten()
             najlepszy_indeks = prawdopodobienstwa_obrazu.argmax()
             wyniki.append({
@@ -65,7 +107,20 @@ def klasyfikuj_obraz_clip_wsadowo(images: list) -> list:
         return wyniki
     except Exception as e:
         # Zwracamy listę błędów, aby pętla mogła kontynuować
-        return [{"błąd": f"Błąd przetwarzania wsadowego z CLIP: {e}"}] * len(images)
+        return [{"błąd": f"Błąd przetwarzania wsadowego z CLIP: {e}"}] * len(lista_bajtow)
+
+
+def _inicjalizuj_tesseract():
+    """Ustawia ścieżkę do Tesseracta w procesach roboczych puli OCR."""
+    if TESSERACT_CMD_PATH:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_PATH
+
+
+def pobierz_obraz(image_url: str) -> bytes:
+    """Pobiera pojedynczy obraz strony."""
+    response = requests.get(image_url, timeout=30)
+    response.raise_for_status()
+    return response.content
 
 
 def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
@@ -74,7 +129,9 @@ def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
         np_arr = np.frombuffer(image_bytes, np.uint8)
         img_cv = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
         img_gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        ocr_data = pytesseract.image_to_data(img_gray, lang='pol', output_type=pytesseract.Output.DICT)
+        # --oem 1 wymusza silnik LSTM, --psm 6 stały tryb segmentacji -
+        # Tesseract nie traci czasu na własną autodetekcję układu strony
+        ocr_data = pytesseract.image_to_data(img_gray, lang='pol', config='--oem 1 --psm 6', output_type=pytesseract.Output.DICT)
         all_heights = [ocr_data['height'][i] for i, conf in enumerate(ocr_data['conf']) if int(conf) > 60 and ocr_data['text'][i].strip()]
         if not all_heights:
             return {"znaleziono_duzy_tekst": False, "info": "Nie znaleziono tekstu na stronie."}
@@ -111,41 +168,59 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5, rozmiar_wsadu: in
 
     batch_danych = []
 
+    ### ZMIANA ### Potok trzech etapów: pobieranie (wątki) -> CLIP (GPU) -> OCR (procesy).
+    # Gdy wsad N siedzi na GPU, wsad N+1 jeszcze się pobiera, a OCR wsadu N
+    # rozchodzi się po rdzeniach CPU - łączny czas zbliża się do najwolniejszego etapu
+    pula_pobierania = ThreadPoolExecutor(max_workers=8)
+    pula_ocr = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_inicjalizuj_tesseract)
+
+    zadania = []  # elementy: (numer_strony, etykieta, future z bajtami obrazu albo None)
     for i, canvas in enumerate(canvases_do_analizy):
         label = canvas.get('label', '[Brak etykiety]')
         image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-        
-        print("-" * 60)
-        print(f"Strona {i+1}/{len(canvases_do_analizy)}: '{label}'")
 
         if not image_service_url:
-            print("  -> POMINIĘTO (brak linku)")
+            zadania.append((i + 1, label, None))
             continue
 
         image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-        print(f"  Pobieranie obrazu: {image_url}")
-
-        try:
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            # Zbieramy dane do paczki
-            batch_danych.append({
-                "image_bytes": response.content,
-                "label": label,
-                "numer_strony": i + 1
-            })
-        except requests.exceptions.RequestException as e:
-            print(f"  BŁĄD POBIERANIA: {e}")
+        zadania.append((i + 1, label, pula_pobierania.submit(pobierz_obraz, image_url)))
+
+    for k, (numer, label, future_pobrania) in enumerate(zadania):
+        print("-" * 60)
+        print(f"Strona {numer}/{len(canvases_do_analizy)}: '{label}'")
+
+        if future_pobrania is None:
+            print("  -> POMINIĘTO (brak linku)")
+        else:
+            try:
+                # Zbieramy dane do paczki
+                batch_danych.append({
+                    "image_bytes": future_pobrania.result(),
+                    "label": label,
+                    "numer_strony": numer
+                })
+            except requests.exceptions.RequestException as e:
+                print(f"  BŁĄD POBIERANIA: {e}")
 
         # Jeśli paczka jest pełna LUB to ostatni element, przetwarzamy paczkę
-        if len(batch_danych) == rozmiar_wsadu or i == len(canvases_do_analizy) - 1:
+        if batch_danych and (len(batch_danych) == rozmiar_wsadu or k == len(zadania) - 1):
             print(f"\n--- Przetwarzanie wsadu {len(batch_danych)} obrazów... ---")
-            
+
             # Krok 1: Klasyfikacja wizualna całej paczki za jednym razem
-            obrazy_do_klasyfikacji = [Image.open(io.BytesIO(dane['image_bytes'])) for dane in batch_danych]
-            wyniki_clip_wsadu = klasyfikuj_obraz_clip_wsadowo(obrazy_do_klasyfikacji)
+            wyniki_clip_wsadu = klasyfikuj_obraz_clip_wsadowo([dane['image_bytes'] for dane in batch_danych])
 
-            # Krok 2: Przetwarzanie wyników i OCR (nadal pojedynczo)
+            # Krok 2: OCR w tle na puli procesów, ale tylko tam, gdzie werdykt
+            # CLIP nie jest rozstrzygający (okładki i strony niepewne)
+            futures_ocr = []
+            for dane, ocena_wstepna in zip(batch_danych, wyniki_clip_wsadu):
+                if ("błąd" not in ocena_wstepna and not ocena_wstepna['jest_okladka_wg_clip']
+                        and ocena_wstepna['prawdopodobienstwo'] > PROG_PEWNOSCI_CLIP):
+                    futures_ocr.append(None)
+                else:
+                    futures_ocr.append(pula_ocr.submit(analizuj_strukture_tekstu_ocr, dane['image_bytes']))
+
+            # Krok 3: Zebranie wyników obu etapów
             for j, dane in enumerate(batch_danych):
                 print(f"  Analiza wyniku dla Strony {dane['numer_strony']}: '{dane['label']}'")
                 ocena_clip = wyniki_clip_wsadu[j]
@@ -154,7 +229,11 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5, rozmiar_wsadu: in
                     continue
                 print(f"    > Ocena modelu: '{ocena_clip['kategoria']}' ({ocena_clip['prawdopodobienstwo']:.2%})")
 
-                analiza_ocr = analizuj_strukture_tekstu_ocr(dane['image_bytes'])
+                if futures_ocr[j] is None:
+                    analiza_ocr = {"znaleziono_duzy_tekst": False,
+                                   "info": "pominięto - wysoka pewność CLIP"}
+                else:
+                    analiza_ocr = futures_ocr[j].result()
                 if "błąd" in analiza_ocr:
                     print(f"    [BŁĄD OCR] {analiza_ocr['błąd']}")
                     continue
@@ -179,6 +258,9 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5, rozmiar_wsadu: in
             # Wyczyść paczkę po przetworzeniu
             batch_danych.clear()
 
+    pula_pobierania.shutdown()
+    pula_ocr.shutdown()
+
     # Sekcja podsumowania (bez zmian)
     print("\n" + "#"*80)
     print("### PODSUMOWANIE ANALIZY (WYNIKI SZCZEGÓŁOWE) ###")
@@ -204,7 +286,9 @@ if __name__ == "__main__":
         print("\n" + "!"*80 + "\nBŁĄD KRYTYCZNY: Nie znaleziono Tesseract OCR.\n" + "!"*80 + "\n")
         exit()
 
-    MANIFEST_DO_ANALIZY_1 = "https://glam.uni.wroc.pl/iiif/GSL_GSL_P_31520_IV_1915_32510/manifest" 
+    zaladuj_model_clip()
+
+    MANIFEST_DO_ANALIZY_1 = "https://glam.uni.wroc.pl/iiif/GSL_GSL_P_31520_IV_1915_32510/manifest"
     # Możesz eksperymentować z `rozmiar_wsadu`. Zacznij od małej wartości (4-8).
     # Jeśli nie masz błędów pamięci, możesz ją zwiększyć.
     analizuj_manifest(MANIFEST_DO_ANALIZY_1, limit_stron=30, rozmiar_wsadu=8)
\ No newline at end of file
